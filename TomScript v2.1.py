@@ -7,8 +7,45 @@ NOTE:
     LIST MUST BE IDENTICAL TO THE SUFFIX CORRESPONDING TO GITHUB!!
 """
 
+import argparse
+import asyncio
+import atexit
+import contextlib
+import contextvars
 import glob
-from git import Repo
+import hashlib
+import io
+import json
+import os
+import random
+import re
+import shutil
+import signal
+import socket
+import socketserver
+import stat
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import wsgiref.simple_server
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from git import (Git, GitCommandError, IndexFile, RemoteProgress, Repo, 
+                 SymbolicReference)
+
+try:
+    import fcntl
+except ImportError:   # Windows, files are never reflinked there
+    fcntl = None
+
+try:
+    from watchdog.observers import Observer
+except ImportError:   # only needed with watch_files on
+    Observer = None
 
 #==============================================================================
 # Contents
@@ -25,26 +62,53 @@ def contents():
     
     Functions:
         
+        0. start(project)
+        
         1. status(repo)
         
+           dashboard()
+        
         2. newbranch(repo)
         
         3. choosebranch(repo)
 
         4. add(repo)
         
+           move2repo(source)
+        
         5. commit(repo)
         
         6. push(repo)
         
+        7. fetch(repo)
+        
     Compound Functions: #WIP
         
         1. compush(repo)
         
         2. addcompush(repo)
         
+        3. sync()
+        
+    Timing:
+        
+        1. profile()
+        
+    Background fetching:
+        
+        1. prefetch(minutes)
+        
+        2. prefetch_status()
+        
+    Lock file:
+        
+        1. lock()
+        
+        2. restore()
+        
     Callable Parameters:
         
+        - workspace
         - project
         - project_URL
         - proj
@@ -76,58 +140,3276 @@ def workflow():
         
         > Use the commit(repo) function to commit files to the repository
         
-        > Use the push(repo) function to push files locally from your computer back up to the GitHub cloud.
-    
-    Note: repo refers to repository, that is, the area on GitHub where all the associated files to that project/library are hosted.
-    '''
-    return help(workflow)
+        > Use the push(repo) function to push files locally from your computer back up to the GitHub cloud.
+    
+    Note: repo refers to repository, that is, the area on GitHub where all the associated files to that project/library are hosted.
+    '''
+    return help(workflow)
+
+#==============================================================================
+# Settings
+#==============================================================================
+
+###############################################################################
+base_URL = 'https://github.com/DigicoUK/'
+directoryprefix = 'Z://new_work_area_12/'
+clone_workers = 8    # number of libraries cloned at the same time
+fanout_workers = 8   # number of repositories worked on at the same time
+execution_engine = 'threads'   # or 'asyncio', see AsyncEngine
+remote_concurrency = 8   # asyncio: remote commands at once on each host
+git_timeout = 600   # asyncio: seconds a git command may take, None for ever
+show_progress = True   # print clone, fetch and push progress as it happens
+profiling = False   # write a trace of every git command when the session ends
+profile_file = directoryprefix + 'trace.json'   # opens in chrome://tracing
+use_mirror_cache = True
+mirror_directory = directoryprefix + 'Mirrors//'
+mirror_cache_size = 20 * 1024**3   # bytes, least recently used removed first
+attach_existing = True   # reuse checkouts left by a previous session
+fast_startup = True   # reopen unchanged checkouts as last left, then fetch
+fetch_on_reopen = True   # fast_startup fetches behind the session
+cache_library_graph = True   # remember which libraries need which
+restore_from_lock = False   # check libraries out at the commits in the lock
+prefetch_minutes = 0   # fetch every repository in the background this often
+prefetch_workers = 2   # number of repositories fetched at the same time
+
+untracked_cache = True   # let git status remember untouched folders
+status_cache_seconds = 30   # longest a cached status is shown without them
+protected_branches = ['master']   # branches nothing may be committed to
+share_libraries = True   # projects opened side by side share library clones
+import_mode = 'move'   # move2repo 'move's files in, or 'copy's them
+import_hardlinks = False   # copies may be hard links to the original file
+watch_files = False   # add and status only look at files seen changing, 
+                      # needs the watchdog package (pip install watchdog)
+
+# Where move2repo puts files, by the start of their path below the folder 
+# imported from: {start: (repository, folder in it)}, e.g. {'adc/': 
+# ('DmiAdc', 'src/')}. Other files go to the repository named by their first
+# folder, e.g. DmiAdc/src/adc.c to src/adc.c in DmiAdc.
+import_routes = {}
+
+# Other names repositories can be called by, e.g. {'adc': 'DmiAdc'}. The
+# project can always be called 'project', and every library by its full
+# GitHub name. Any unique start of a name works too, e.g. 'Dmi'.
+repo_aliases = {}
+
+# How the libraries are cloned, per project. Projects not listed use 'default'.
+#   depth  : commits of history to fetch, None for the full history
+#   filter : partial clone filter, e.g. 'blob:none', None for every file
+#   sparse : folders to check out, [] for the whole tree
+# The project itself is always cloned in full so its Lib file can be read.
+library_clone_options = {
+    'default': {'depth': None, 'filter': None, 'sparse': []},
+}
+
+# Connection reuse, applied to every repository opened or cloned, so pushing
+# or fetching many repositories on the same host sets up the connection once.
+#   ssh_multiplex    : share one SSH connection per host (ControlMaster),
+#                      kept open ssh_persist seconds after the last use
+#   credential_cache : seconds an HTTPS login is remembered, 0 to not cache
+#   http_version     : HTTP version git asks for, e.g. 'HTTP/2'
+#   url_rewrites     : {new: old} URL prefixes, e.g. to reach GitHub over
+#                      SSH: {'git@github.com:': 'https://github.com/'}
+transport_settings = {
+    'ssh_multiplex': True,
+    'ssh_persist': 600,
+    'credential_cache': 3600,
+    'http_version': 'HTTP/2',
+    'url_rewrites': {},
+}
+
+# What clones, fetches and pushes do when GitHub is slow or unreachable
+#   timeouts         : seconds one attempt may take, by operation
+#   retries          : attempts after the first, only for failures that look
+#                      temporary (dropped connections, timeouts, HTTP 5xx), 
+#                      not e.g. a rejected push or a wrong password
+#   backoff          : seconds before the first retry, doubled for each one 
+#                      after up to max_backoff, less up to half at random
+#   low_speed        : (bytes per second, seconds), an HTTPS transfer slower
+#                      than this for that long is dropped, and retried
+#   breaker_failures : temporary failures in a row after which a host is 
+#                      not tried for breaker_seconds, see CircuitBreaker
+remote_policy = {
+    'timeouts': {'clone': 3600, 'fetch': 600, 'push': 600},
+    'retries': 3,
+    'backoff': 2,
+    'max_backoff': 60,
+    'low_speed': (1000, 60),
+    'breaker_failures': 5,
+    'breaker_seconds': 120,
+}
+###############################################################################
+
+#==============================================================================
+# Instrumentation
+#==============================================================================
+
+class Tracer:
+    '''
+    Record of every git command and remote operation of the session.
+    
+    Each record holds the repository (folder name), command (e.g. status,
+    or clone/fetch/push for remote operations), start time, seconds taken,
+    exit status (0 for success), bytes transferred where git reported it,
+    and kind ('git' or 'remote'). The newest 100000 are kept.
+    '''
+    
+    def __init__(self):
+        self.records = deque(maxlen=100000)
+        self.lock = threading.Lock()
+    
+    def record(self, repo, command, started, seconds, status, 
+               transferred=None, kind='git'):
+        with self.lock:
+            self.records.append({'repo': repo, 'command': command, 
+                                 'started': started, 'seconds': seconds,
+                                 'status': status, 'bytes': transferred,
+                                 'kind': kind})
+    
+    def summary(self, count=5):
+        '''
+        The repositories and commands that took longest
+        
+        Returns
+        -------
+        out : dictionary
+            'repos' and 'commands', each a list of (total seconds, number
+            of calls, name), slowest first, and 'calls', the slowest single
+            records.
+        '''
+        
+        with self.lock:
+            records = list(self.records)
+        
+        totals = {'repos': {}, 'commands': {}}
+        for x in records:
+            for group, name in [('repos', x['repo']), 
+                                ('commands', x['kind'] + ' ' + x['command'])]:
+                seconds, calls = totals[group].get(name, (0.0, 0))
+                totals[group][name] = (seconds + x['seconds'], calls + 1)
+        
+        summary = {}
+        for group in totals:
+            ranked = [(totals[group][x][0], totals[group][x][1], x) 
+                      for x in totals[group]]
+            ranked.sort(reverse=True)
+            summary[group] = ranked[:count]
+        records.sort(key=lambda x: x['seconds'], reverse=True)
+        summary['calls'] = records[:count]
+        return summary
+    
+    def write_trace(self, path):
+        '''
+        Write the records as a Chrome trace (JSON), one row per repository.
+        Open it in chrome://tracing or ui.perfetto.dev.
+        '''
+        
+        with self.lock:
+            records = list(self.records)
+        
+        rows = {}
+        events = []
+        for x in records:
+            if x['repo'] not in rows:
+                rows[x['repo']] = len(rows) + 1
+                events.append({'name': 'thread_name', 'ph': 'M', 'pid': 1, 
+                               'tid': rows[x['repo']], 
+                               'args': {'name': x['repo']}})
+            events.append({'name': x['command'], 'cat': x['kind'], 
+                           'ph': 'X', 'pid': 1, 'tid': rows[x['repo']],
+                           'ts': int(x['started'] * 1e6), 
+                           'dur': int(x['seconds'] * 1e6),
+                           'args': {'status': x['status'], 
+                                    'bytes': x['bytes']}})
+        
+        folder = os.path.dirname(path)
+        if folder and not os.path.isdir(folder):
+            os.makedirs(folder)
+        with open(path, 'w') as saved:
+            json.dump({'traceEvents': events}, saved)
+        return path
+
+tracer = Tracer()
+
+# Git subcommand of a command line, e.g. 'status' for git -c x=y status -s
+def git_subcommand(command):
+    if isinstance(command, str):
+        command = command.split()
+    skip = False
+    for part in list(command)[1:]:
+        part = str(part)
+        if skip:
+            skip = False
+        elif part in ('-c', '-C'):
+            skip = True
+        elif not part.startswith('-'):
+            return part
+    return 'git'
+
+class TimedGit(Git):
+    '''
+    GitPython's Git, recording each command it runs with the tracer.
+    
+    Commands started as background processes (clone, fetch and push with 
+    progress) return straight away, so they are recorded by the 
+    ProgressReporter when they finish instead.
+    '''
+    
+    def execute(self, command, *args, **kwargs):
+        # Killed once the time of the remote operation running runs out
+        deadline = getattr(remote_context, 'deadline', None)
+        if deadline is not None and not deadline.seconds:
+            deadline = None
+        
+        if kwargs.get('as_process'):
+            process = Git.execute(self, command, *args, **kwargs)
+            if deadline is not None:
+                deadline.watch(process.proc)
+            return process
+        
+        # GitPython can only time commands out itself off Windows
+        if deadline is not None and os.name != 'nt':
+            kwargs.setdefault('kill_after_timeout', deadline.seconds)
+        
+        started = time.time()
+        status = 0
+        try:
+            return Git.execute(self, command, *args, **kwargs)
+        except GitCommandError as error:
+            status = error.status
+            if (deadline is not None 
+                    and time.time() - started >= deadline.seconds):
+                deadline.timed_out = True
+            raise
+        except Exception:
+            status = -1
+            raise
+        finally:
+            repo = os.path.basename(os.path.normpath(self._working_dir or 
+                                                     os.getcwd()))
+            tracer.record(repo, git_subcommand(command), started, 
+                          time.time() - started, status)
+
+# Repo whose git commands are all recorded
+class TimedRepo(Repo):
+    GitCommandWrapperType = TimedGit
+
+# Print the tracer summary, and write the trace file when profiling
+def profile(count=5):
+    '''
+    Where the time of this session went
+    
+    Parameters
+    ----------
+    count : int
+        Number of repositories, commands and single calls listed.
+    
+    Returns
+    -------
+    out : summary
+        See Tracer.summary. With profiling on the full trace is also written
+        to profile_file.
+    '''
+    
+    summary = tracer.summary(count)
+    print('Slowest repositories:')
+    for seconds, calls, name in summary['repos']:
+        print('    %-30s %8.2fs in %d calls' % (name, seconds, calls))
+    print('Slowest commands:')
+    for seconds, calls, name in summary['commands']:
+        print('    %-30s %8.2fs in %d calls' % (name, seconds, calls))
+    print('Slowest calls:')
+    for x in summary['calls']:
+        print('    %-30s %8.2fs  %s, exit %s' % (x['repo'], x['seconds'], 
+                                               x['command'], x['status']))
+    if profiling:
+        print('Trace written to ' + tracer.write_trace(profile_file))
+    return summary
+
+# The trace is written when the session ends too
+def write_profile():
+    if profiling and tracer.records:
+        tracer.write_trace(profile_file)
+
+atexit.register(write_profile)
+
+#==============================================================================
+# Progress
+#==============================================================================
+
+# Units git uses when it reports how much it has transferred
+byte_units = {'bytes': 1, 'KiB': 1024, 'MiB': 1024**2, 'GiB': 1024**3}
+
+class ProgressReporter:
+    '''
+    Collects the progress of clones, fetches and pushes running at the same
+    time, in one place.
+    
+    Every start, progress update and finish is kept as an event dictionary
+    in events, and handed to each function in listeners as it happens. With
+    printing on, progress is also printed to the terminal, at most once per
+    interval seconds for each repository.
+    
+    Event keys: time, repo, action (clone/fetch/push), event (start/progress
+    /finish), and for progress events stage, current, total, bytes, rate
+    (bytes per second) and eta (seconds). Finish events have seconds and 
+    error.
+    
+    Parameters
+    ----------
+    printing : bool
+        Print progress to the terminal.
+        
+    interval : float
+        Seconds between printed updates of the same repository.
+    '''
+    
+    def __init__(self, printing=True, interval=1.0):
+        self.printing = printing
+        self.interval = interval
+        self.events = deque(maxlen=10000)
+        self.listeners = []
+        self.timings = {}
+        self.started = {}
+        self.stages = {}
+        self.printed = {}
+        self.lock = threading.Lock()
+    
+    # Hand an event to the event list, listeners and terminal
+    def emit(self, event):
+        with self.lock:
+            self.events.append(event)
+            listeners = list(self.listeners)
+            if self.printing:
+                self.print_event(event)
+        for listener in listeners:
+            listener(event)
+    
+    def print_event(self, event):
+        if event['event'] != 'progress':
+            return
+        
+        # Print on a new stage, otherwise only every interval seconds
+        key = (event['repo'], event['action'])
+        last = self.printed.get(key)
+        if (last is not None and last[0] == event['stage'] 
+                and event['time'] - last[1] < self.interval):
+            return
+        self.printed[key] = (event['stage'], event['time'])
+        
+        line = '    %s %s: %s' % (event['repo'], event['action'], 
+                                  event['stage'])
+        if event['total']:
+            line += ' %d%% (%d/%d)' % (100 * event['current'] / event['total'],
+                                       event['current'], event['total'])
+        if event['bytes']:
+            line += ', %.1f MiB' % (event['bytes'] / 1024**2)
+        if event['rate']:
+            line += ' at %.1f MiB/s' % (event['rate'] / 1024**2)
+        if event['eta'] is not None:
+            line += ', %ds left' % event['eta']
+        print(line)
+    
+    def begin(self, repo, action):
+        now = time.time()
+        self.started[(repo, action)] = now
+        self.emit({'time': now, 'repo': repo, 'action': action, 
+                   'event': 'start'})
+    
+    def update(self, repo, action, stage, current, total, message):
+        now = time.time()
+        
+        # Time the stage started, for the estimate of the time left
+        key = (repo, action)
+        if self.stages.get(key, (None,))[0] != stage:
+            self.stages[key] = (stage, now, current)
+        started, first = self.stages[key][1], self.stages[key][2]
+        
+        eta = None
+        if total and current > first and now > started:
+            speed = (current - first) / (now - started)
+            eta = (total - current) / speed
+        
+        # git adds e.g. '1.23 MiB | 512.00 KiB/s' while transferring
+        amounts = re.findall(r'([\d.]+) (bytes|KiB|MiB|GiB)', message or '')
+        amounts = [float(x) * byte_units[unit] for x, unit in amounts]
+        
+        self.emit({'time': now, 'repo': repo, 'action': action,
+                   'event': 'progress', 'stage': stage, 'current': current,
+                   'total': total, 
+                   'bytes': amounts[0] if amounts else None,
+                   'rate': amounts[1] if len(amounts) > 1 else None,
+                   'eta': eta})
+    
+    # Returns the seconds the action took
+    def finish(self, repo, action, error=None):
+        now = time.time()
+        started = self.started.pop((repo, action), now)
+        seconds = now - started
+        self.stages.pop((repo, action), None)
+        self.timings[(repo, action)] = seconds
+        
+        # Last amount transferred that git reported, for the tracer
+        transferred = None
+        with self.lock:
+            for event in reversed(self.events):
+                if event['repo'] == repo and event['action'] == action:
+                    if event['event'] == 'start':
+                        break
+                    if event.get('bytes'):
+                        transferred = int(event['bytes'])
+                        break
+        status = 0
+        if error is not None:
+            status = getattr(error, 'status', -1)
+        tracer.record(repo, action, started, seconds, status, transferred,
+                      'remote')
+        
+        self.emit({'time': now, 'repo': repo, 'action': action, 
+                   'event': 'finish', 'seconds': seconds, 'error': error})
+        return seconds
+    
+    # Run function(*args, progress=...), reporting its start, progress and end
+    def run(self, repo, action, function, *args, **kwargs):
+        self.begin(repo, action)
+        try:
+            result = function(*args, progress=RepoProgress(self, repo, action),
+                              **kwargs)
+        except Exception as error:
+            self.finish(repo, action, error)
+            raise
+        self.finish(repo, action)
+        return result
+    
+    # The slowest finished actions, as (seconds, repo, action)
+    def slowest(self, count=5):
+        times = [(self.timings[x], x[0], x[1]) for x in self.timings]
+        times.sort(reverse=True)
+        return times[:count]
+
+# Passes GitPython's progress callbacks for one repository to a reporter
+class RepoProgress(RemoteProgress):
+    
+    stage_names = [(RemoteProgress.COUNTING, 'Counting objects'),
+                   (RemoteProgress.COMPRESSING, 'Compressing objects'),
+                   (RemoteProgress.WRITING, 'Writing objects'),
+                   (RemoteProgress.RECEIVING, 'Receiving objects'),
+                   (RemoteProgress.RESOLVING, 'Resolving deltas'),
+                   (RemoteProgress.FINDING_SOURCES, 'Finding sources'),
+                   (RemoteProgress.CHECKING_OUT, 'Checking out files')]
+    
+    def __init__(self, reporter, repo, action):
+        RemoteProgress.__init__(self)
+        self.reporter = reporter
+        self.repo = repo
+        self.action = action
+    
+    def update(self, op_code, cur_count, max_count=None, message=''):
+        stage = 'Working'
+        for code, name in self.stage_names:
+            if op_code & self.OP_MASK == code:
+                stage = name
+        self.reporter.update(self.repo, self.action, stage, cur_count or 0,
+                             max_count or 0, message)
+
+#==============================================================================
+# Connections
+#==============================================================================
+
+# Extra git settings for this session only, passed through the environment
+# (GIT_CONFIG_COUNT) so nothing is written to the repositories' config files
+def session_config():
+    settings = transport_settings
+    config = []
+    
+    # Windows keeps logins in its own credential manager already
+    if settings.get('credential_cache') and os.name != 'nt':
+        config.append(('credential.helper', 
+                       'cache --timeout=%d' % settings['credential_cache']))
+    if settings.get('http_version'):
+        config.append(('http.version', settings['http_version']))
+    if untracked_cache:
+        config.append(('core.untrackedCache', 'true'))
+    if remote_policy.get('low_speed'):
+        limit, seconds = remote_policy['low_speed']
+        config.append(('http.lowSpeedLimit', str(limit)))
+        config.append(('http.lowSpeedTime', str(seconds)))
+    
+    rewrites = settings.get('url_rewrites') or {}
+    for new in rewrites:
+        config.append(('url.' + new + '.insteadOf', rewrites[new]))
+    return config
+
+def transport_environment():
+    '''
+    Environment variables git is run with, so that every repository shares
+    connections and logins
+    
+    Returns
+    -------
+    out : dictionary
+        GIT_SSH_COMMAND using an SSH ControlMaster socket (not on Windows,
+        where OpenSSH does not support it) and GIT_CONFIG_* entries for the
+        settings of session_config, added after any already in the 
+        environment.
+    '''
+    
+    settings = transport_settings
+    env = {}
+    
+    if settings.get('ssh_multiplex') and os.name != 'nt':
+        # Kept short, socket paths are limited to around 100 characters
+        sockets = os.path.join(tempfile.gettempdir(), 'tomscript-ssh')
+        if not os.path.isdir(sockets):
+            os.makedirs(sockets, mode=0o700, exist_ok=True)
+        ssh = os.environ.get('GIT_SSH_COMMAND', 'ssh')
+        env['GIT_SSH_COMMAND'] = (ssh + ' -o ControlMaster=auto'
+                                  + ' -o ControlPath=' + sockets + '/%C'
+                                  + ' -o ControlPersist=%d' 
+                                  % settings.get('ssh_persist', 600))
+    
+    config = session_config()
+    if config:
+        count = int(os.environ.get('GIT_CONFIG_COUNT', '0'))
+        for key, value in config:
+            env['GIT_CONFIG_KEY_%d' % count] = key
+            env['GIT_CONFIG_VALUE_%d' % count] = value
+            count += 1
+        env['GIT_CONFIG_COUNT'] = str(count)
+    return env
+
+# Open an existing repository with the connection settings applied
+def open_repo(path):
+    repo = TimedRepo(path)
+    repo.git.update_environment(**transport_environment())
+    return repo
+
+#==============================================================================
+# Asyncio engine
+#==============================================================================
+
+# Host a remote URL is on, e.g. github.com, 'local' for folders and file://
+def remote_host(url):
+    if '://' in url:
+        return urllib.parse.urlsplit(url).hostname or 'local'
+    match = re.match(r'^(?:[^@/]+@)?([^/:]+):', url)
+    if match and len(match.group(1)) > 1:   # not a Windows drive letter
+        return match.group(1)
+    return 'local'
+
+# Kill a git process and the helpers it started (ssh, git-remote-https), 
+# which hold the connection and would otherwise keep running
+def kill_process_tree(process):
+    if os.name == 'nt':
+        subprocess.run(['taskkill', '/T', '/F', '/PID', str(process.pid)],
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        return
+    
+    with contextlib.suppress(OSError):
+        if os.getpgid(process.pid) == process.pid:
+            os.killpg(process.pid, signal.SIGKILL)
+            return
+    
+    # Started by GitPython, in the session's group: everything under it
+    # (a transport may run through a shell), then it
+    found, pending = [], [process.pid]
+    while pending:
+        with contextlib.suppress(OSError):
+            children = subprocess.run(['pgrep', '-P', str(pending.pop())], 
+                                      stdout=subprocess.PIPE).stdout.split()
+            found.extend(int(child) for child in children)
+            pending.extend(int(child) for child in children)
+    for pid in found:
+        with contextlib.suppress(OSError):
+            os.kill(pid, signal.SIGKILL)
+    with contextlib.suppress(OSError):
+        process.kill()
+
+class AsyncEngine:
+    '''
+    Runs git as asyncio subprocesses, so one thread can wait on hundreds of
+    repositories at once.
+    
+    Commands that reach a remote run at most concurrency at a time for 
+    each host, other commands at most fanout_workers at a time. Every 
+    command has a timeout, and is killed when it runs out or when the task
+    waiting on it is cancelled (e.g. by Ctrl+C), so a hung push ends 
+    without ending the session.
+    
+    Parameters
+    ----------
+    concurrency : int
+        Remote commands running at once on each host. Defaults to 
+        remote_concurrency.
+        
+    timeout : float
+        Seconds each command may take. Defaults to git_timeout.
+    
+    Notes
+    -----
+    Used through run_git by the Workspace coroutines (add_async and so on)
+    when execution_engine is 'asyncio'.
+    '''
+    
+    def __init__(self, concurrency=None, timeout=None):
+        self.concurrency = concurrency or remote_concurrency
+        self.timeout = timeout or git_timeout
+        self.limits = {}
+        self.environment = dict(os.environ, **transport_environment())
+    
+    # Semaphore of a host, made on first use inside the running event loop
+    def limit(self, remote):
+        host = remote_host(remote) if remote else None
+        if host not in self.limits:
+            size = self.concurrency if remote else fanout_workers
+            self.limits[host] = asyncio.Semaphore(max(1, size))
+        return self.limits[host]
+    
+    async def git(self, repo, *args, remote=None, timeout=None):
+        '''
+        Run one git command in a repository
+        
+        Parameters
+        ----------
+        repo : Repo
+            Repository the command runs in.
+            
+        args : 
+            Command and its arguments, e.g. 'push', 'origin', 'dev'.
+            
+        remote : string
+            URL the command reaches, None for a local command.
+            
+        timeout : float
+            Seconds it may take, instead of the engine's.
+        
+        Returns
+        -------
+        out : string
+            Output of the command. Raises GitCommandError if it fails, or
+            TimeoutError if it runs out of time.
+        '''
+        
+        command = [Git.GIT_PYTHON_GIT_EXECUTABLE or 'git'] + list(args)
+        timeout = timeout or self.timeout
+        name = os.path.basename(os.path.normpath(repo.working_tree_dir))
+        kind = 'remote' if remote else 'git'
+        
+        # In a group of its own, so its helpers can be killed with it
+        group = {}
+        if os.name == 'nt':
+            group['creationflags'] = subprocess.CREATE_NEW_PROCESS_GROUP
+        else:
+            group['start_new_session'] = True
+        
+        async with self.limit(remote):
+            started = time.time()
+            process = await asyncio.create_subprocess_exec(
+                *command, cwd=repo.working_tree_dir, env=self.environment,
+                stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, 
+                stderr=subprocess.PIPE, **group)
+            try:
+                stdout, stderr = await asyncio.wait_for(process.communicate(),
+                                                        timeout)
+            except BaseException as error:
+                if process.returncode is None:
+                    kill_process_tree(process)
+                    await process.wait()
+                tracer.record(name, git_subcommand(command), started, 
+                              time.time() - started, -1, None, kind)
+                if isinstance(error, asyncio.TimeoutError):
+                    raise TimeoutError('git %s timed out after %gs' 
+                                       % (git_subcommand(command), timeout))
+                raise
+        
+        tracer.record(name, git_subcommand(command), started, 
+                      time.time() - started, process.returncode, None, kind)
+        stdout = stdout.decode('utf-8', 'replace')
+        if process.returncode:
+            raise GitCommandError(command, process.returncode, 
+                                  stderr.decode('utf-8', 'replace'), stdout)
+        return stdout[:-1] if stdout.endswith('\n') else stdout
+
+# Engine run_git uses in the current task, None outside run_async
+current_engine = contextvars.ContextVar('current_engine', default=None)
+
+# Run a git command on the current AsyncEngine, or through GitPython if none
+# is running, so coroutines work the same on either engine. Commands given a
+# remote follow remote_policy.
+async def run_git(repo, *args, remote=None):
+    engine = current_engine.get()
+    if engine is None:
+        command = [Git.GIT_PYTHON_GIT_EXECUTABLE or 'git'] + list(args)
+        if remote is None:
+            return repo.git.execute(command)
+        return remote_call(remote, args[0], repo.git.execute, command)
+    if remote is None:
+        return await engine.git(repo, *args)
+    return await remote_call_async(
+        remote, args[0], engine.git, repo, *args, remote=remote, 
+        timeout=remote_policy['timeouts'].get(args[0]))
+
+# Run a coroutine on a new AsyncEngine and return its result. Ctrl+C kills
+# the git commands it has running.
+def run_async(coroutine):
+    async def main():
+        current_engine.set(AsyncEngine())
+        return await coroutine
+    
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(main())
+    
+    # Called from inside a running event loop (e.g. Jupyter), which cannot
+    # be waited on, so the engine gets a thread of its own
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        return pool.submit(asyncio.run, main()).result()
+
+#==============================================================================
+# Remote policy
+#==============================================================================
+
+# Signs in git's message that a failure was the connection's, and trying 
+# again may work. Rejected pushes, missing repositories, and logins refused
+# (HTTP 401/403) are not.
+transient_errors = re.compile('|'.join([
+    r'timed? ?out', r'could not resolve host', r'temporary failure',
+    r'connection (was )?(reset|refused|closed|aborted)', r'broken pipe',
+    r'failed to connect', r'remote end hung up', r'early eof', 
+    r'unexpected disconnect', r'rpc failed', r'error: 5\d\d', 
+    r'operation too slow', r'ssl|tls|gnutls', r'kex_exchange_identification',
+]), re.IGNORECASE)
+
+# The line of an error that says what went wrong, e.g. git's 'fatal: ...'
+def error_line(error):
+    found = re.search(r'(fatal|error): .*', str(error))
+    return found.group(0).rstrip("'") if found else str(error).strip()
+
+class RemoteUnavailable(ConnectionError):
+    '''
+    Raised instead of trying a host its CircuitBreaker has given up on
+    '''
+
+def is_transient(error):
+    if isinstance(error, RemoteUnavailable):
+        return False
+    if isinstance(error, (TimeoutError, asyncio.TimeoutError)):
+        return True
+    return transient_errors.search(str(error)) is not None
+
+class CircuitBreaker:
+    '''
+    Counts the temporary failures in a row of each host. After 
+    breaker_failures of them (see remote_policy) the host is given up on 
+    for breaker_seconds: its clones, fetches and pushes fail straight away
+    with RemoteUnavailable, rather than each waiting out its timeout and 
+    retries. Then one operation is let through to try the host again, and 
+    one that gets an answer, even a refusal, resets the count.
+    '''
+    
+    def __init__(self):
+        self.failures = {}
+        self.opened = {}
+        self.lock = threading.Lock()
+    
+    # Raises RemoteUnavailable if the host is not to be tried
+    def check(self, host):
+        with self.lock:
+            opened = self.opened.get(host)
+            if opened is None:
+                return
+            left = opened + remote_policy['breaker_seconds'] - time.time()
+            if left > 0:
+                raise RemoteUnavailable(
+                    '%s failed %d times in a row, not tried again for %ds' 
+                    % (host, self.failures[host], left))
+            # This caller tries it, the rest wait another full period
+            self.opened[host] = time.time()
+    
+    def success(self, host):
+        with self.lock:
+            self.failures.pop(host, None)
+            self.opened.pop(host, None)
+    
+    def failure(self, host):
+        with self.lock:
+            self.failures[host] = self.failures.get(host, 0) + 1
+            if self.failures[host] >= remote_policy['breaker_failures']:
+                self.opened[host] = time.time()
+
+breaker = CircuitBreaker()
+
+# The Deadline of the remote operation running on each thread, see TimedGit
+remote_context = threading.local()
+
+class Deadline:
+    '''
+    Time limit of the git commands a thread runs while it is entered. 
+    TimedGit passes it to GitPython as kill_after_timeout, or, for commands 
+    reporting progress as they run, kills them itself once it runs out.
+    
+    Parameters
+    ----------
+    seconds : float
+        Time each command may take, None for no limit.
+    '''
+    
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.timed_out = False
+        self.timers = []
+        self.previous = None
+    
+    def __enter__(self):
+        self.previous = getattr(remote_context, 'deadline', None)
+        remote_context.deadline = self
+        return self
+    
+    def __exit__(self, *exception):
+        for timer in self.timers:
+            timer.cancel()
+        remote_context.deadline = self.previous
+    
+    # Kill a running process (a Popen) if it is still running at the end
+    def watch(self, process):
+        def expire():
+            if process.poll() is None:
+                self.timed_out = True
+                kill_process_tree(process)
+        
+        timer = threading.Timer(self.seconds, expire)
+        timer.daemon = True
+        timer.start()
+        self.timers.append(timer)
+
+# Count a failed attempt against its host. Returns the seconds to wait 
+# before the next attempt, or None if there is to be none.
+def retry_delay(url, action, error, attempt):
+    host = remote_host(url)
+    if not is_transient(error):
+        breaker.success(host)   # it answered
+        return None
+    breaker.failure(host)
+    if attempt >= remote_policy['retries']:
+        return None
+    
+    delay = min(remote_policy['backoff'] * 2 ** attempt, 
+                remote_policy['max_backoff'])
+    delay *= random.uniform(0.5, 1.0)
+    print('    %s %s failed (%s), trying again in %.0fs' 
+          % (url.rstrip('/').split('/')[-1], action, error_line(error), 
+             delay))
+    return delay
+
+def remote_call(url, action, function, *args, **kwargs):
+    '''
+    Run a clone, fetch or push under remote_policy
+    
+    Parameters
+    ----------
+    url : string
+        Remote the operation reaches. Its host has the circuit breaker.
+        
+    action : string
+        'clone', 'fetch' or 'push', which picks the timeout.
+        
+    function : function
+        Runs the operation, called with args and kwargs. Called again for
+        each retry, so it must be safe to repeat.
+    
+    Returns
+    -------
+    out : result
+        Whatever function returns. If every attempt fails the last error is
+        raised, a TimeoutError if it ran out of time, or RemoteUnavailable 
+        if the host is not being tried.
+    '''
+    
+    seconds = remote_policy['timeouts'].get(action)
+    attempt = 0
+    while True:
+        breaker.check(remote_host(url))
+        with Deadline(seconds) as deadline:
+            try:
+                result = function(*args, **kwargs)
+                breaker.success(remote_host(url))
+                return result
+            except Exception as error:
+                cause = failure = error
+                if deadline.timed_out and not isinstance(error, TimeoutError):
+                    failure = TimeoutError('git %s timed out after %gs' 
+                                           % (action, seconds))
+        delay = retry_delay(url, action, failure, attempt)
+        if delay is None:
+            if failure is cause:
+                raise failure
+            raise failure from cause
+        time.sleep(delay)
+        attempt += 1
+
+# remote_call for a coroutine function, see AsyncEngine
+async def remote_call_async(url, action, function, *args, **kwargs):
+    attempt = 0
+    while True:
+        breaker.check(remote_host(url))
+        try:
+            result = await function(*args, **kwargs)
+            breaker.success(remote_host(url))
+            return result
+        except Exception as error:
+            delay = retry_delay(url, action, error, attempt)
+            if delay is None:
+                raise
+        await asyncio.sleep(delay)
+        attempt += 1
+
+#==============================================================================
+# Cloning
+#==============================================================================
+
+# Mirror cache ----------------------------------------------------------------
+# A bare copy of each repository is kept in mirror_directory between sessions.
+# Working copies are cloned from the mirror on the local disk (git hardlinks 
+# the objects), so only the objects new since the last session come over the
+# network when the mirror is fetched.
+
+# Folder of the mirror belonging to a repository URL
+def mirror_path(url):
+    name = url.rstrip('/').split('/')[-1]
+    if name.endswith('.git'):
+        name = name[:-4]
+    key = hashlib.sha1(url.encode('utf-8')).hexdigest()[:10]
+    return mirror_directory + name + '-' + key + '.git'
+
+# Create the mirror of a repository, or fetch what is new if it exists already
+def update_mirror(url, progress=None):
+    path = mirror_path(url)
+    
+    if os.path.isdir(path):
+        mirror = open_repo(path)
+        remote_call(url, 'fetch', mirror.remote('origin').fetch, prune=True, 
+                    progress=progress)
+    else:
+        mirror = remote_call(url, 'clone', clone_fresh, url, path, 
+                             progress=progress, env=transport_environment(), 
+                             bare=True)
+        with mirror.config_writer() as config:
+            config.set_value('remote "origin"', 'fetch', 
+                             '+refs/heads/*:refs/heads/*')
+            config.add_value('remote "origin"', 'fetch', 
+                             '+refs/tags/*:refs/tags/*')
+    
+    # Last used time, read by evict_mirrors
+    os.utime(path, None)
+    return mirror
+
+# Clone, first removing what a failed attempt left behind. Only for paths 
+# that are not a checkout to begin with.
+def clone_fresh(url, path, **kwargs):
+    if os.path.exists(path):
+        shutil.rmtree(path, onerror=remove_readonly)
+    return TimedRepo.clone_from(url, path, **kwargs)
+
+# Clone into a folder that is already there, which is kept. What a failed 
+# attempt left in it is removed only if it was empty to begin with.
+def clone_into(url, path, empty, **kwargs):
+    if empty:
+        for name in os.listdir(path):
+            child = os.path.join(path, name)
+            if os.path.isdir(child) and not os.path.islink(child):
+                shutil.rmtree(child, onerror=remove_readonly)
+            else:
+                os.remove(child)
+    return TimedRepo.clone_from(url, path, **kwargs)
+
+# Clone a repository, going through the mirror cache when it is switched on.
+# options holds the depth/filter/sparse settings of library_clone_options.
+def clone_repo(url, path, options=None, progress=None):
+    options = options or {}
+    
+    flags = {}
+    if options.get('depth'):
+        # Shallow clones default to one branch, choosebranch needs them all
+        flags['depth'] = options['depth']
+        flags['no_single_branch'] = True
+    if options.get('filter'):
+        flags['filter'] = options['filter']
+    if options.get('sparse'):
+        flags['sparse'] = True
+    
+    # A shallow or partial clone is already small, and git can't make one 
+    # from a local path, so these go straight to GitHub
+    if not use_mirror_cache or 'depth' in flags or 'filter' in flags:
+        if os.path.exists(path):
+            # Not a checkout (or it would be attached). git only clones 
+            # into it if it is empty, so it is kept, and emptied again for
+            # a retry only if it started empty.
+            repo = remote_call(url, 'clone', clone_into, url, path, 
+                               not os.listdir(path), progress=progress, 
+                               env=transport_environment(), **flags)
+        else:
+            repo = remote_call(url, 'clone', clone_fresh, url, path, 
+                               progress=progress, env=transport_environment(),
+                               **flags)
+    else:
+        mirror = update_mirror(url, progress)
+        repo = TimedRepo.clone_from(mirror.git_dir, path, progress=progress, 
+                                    env=transport_environment(), **flags)
+        
+        # Point origin back at GitHub so pushes and fetches skip the mirror
+        repo.remote('origin').set_url(url)
+    
+    if options.get('sparse'):
+        repo.git.sparse_checkout('set', *options['sparse'])
+    return repo
+
+# Attach mode -----------------------------------------------------------------
+# A folder that is already a checkout is opened where it is and fetched,
+# rather than cloned again. Only missing repositories are cloned.
+
+# True if the folder already holds a git checkout
+def is_checkout(path):
+    return os.path.exists(os.path.join(path, '.git'))
+
+# Open and fetch an existing checkout, or clone it if it is missing
+def attach_or_clone(url, path, options=None, progress=None):
+    if attach_existing and is_checkout(path):
+        repo = open_repo(path)
+        remote_call(url, 'fetch', repo.remote('origin').fetch, prune=True, 
+                    progress=progress)
+        return repo
+    return clone_repo(url, path, options, progress)
+
+# Size of a folder on disk, in bytes
+def folder_size(path):
+    size = 0
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            try:
+                size += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return size
+
+# Git marks its object files read-only, which stops rmtree on Windows
+def remove_readonly(function, path, excinfo):
+    os.chmod(path, stat.S_IWRITE)
+    function(path)
+
+def evict_mirrors(limit):
+    '''
+    Remove the least recently used mirrors until the cache fits in limit
+    
+    Parameters
+    ----------
+    limit : int
+        Largest size in bytes the mirror cache may take up.
+    
+    Returns
+    -------
+    out : removed
+        List of mirror folders that were removed. Working copies keep their
+        own (hardlinked) objects, so removing a mirror never breaks them.
+    '''
+    
+    if not os.path.isdir(mirror_directory):
+        return []
+    
+    mirrors = []
+    for name in os.listdir(mirror_directory):
+        path = os.path.join(mirror_directory, name)
+        if os.path.isdir(path):
+            mirrors.append((os.path.getmtime(path), folder_size(path), path))
+    mirrors.sort()
+    
+    total = sum(x[1] for x in mirrors)
+    removed = []
+    for used, size, path in mirrors:
+        if total <= limit:
+            break
+        shutil.rmtree(path, onerror=remove_readonly)
+        total -= size
+        removed.append(path)
+    return removed
+
+# Clone the libraries a few at a time. One library failing does not stop the
+# others, the errors are collected and handed back instead.
+def clone_libraries(urls, names, destination, workers, options=None, 
+                    reporter=None):
+    '''
+    Clone each library into the destination folder using a pool of workers.
+    Libraries already checked out there are attached instead (attach_existing)
+    
+    Parameters
+    ----------
+    urls : list
+        Library URLs, in the order they appear in the Lib file.
+        
+    names : list
+        Library names, same order as urls. Each is cloned to destination+name.
+        
+    destination : string
+        Folder the libraries are cloned into.
+        
+    workers : int
+        Number of libraries cloned at the same time.
+        
+    options : dictionary
+        Optional depth/filter/sparse settings, see library_clone_options.
+        
+    reporter : ProgressReporter
+        Where the progress of each clone is sent. Nothing is printed but the
+        finished libraries if not given.
+    
+    Returns
+    -------
+    out : clones, errors
+        clones is a list of Repo objects in the same order as urls, with None
+        where that library failed. errors maps library name to the exception.
+    '''
+    
+    clones = [None] * len(urls)
+    errors = {}
+    done = 0
+    reporter = reporter or ProgressReporter(printing=False)
+    
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        jobs = {}
+        actions = []
+        for i in range(len(urls)):
+            path = destination + names[i]
+            if attach_existing and is_checkout(path):
+                actions.append('Attached')
+            else:
+                actions.append('Cloned')
+            job = pool.submit(reporter.run, names[i], 'clone', 
+                              attach_or_clone, urls[i], path, options)
+            jobs[job] = i
+        
+        for job in as_completed(jobs):
+            i = jobs[job]
+            done += 1
+            try:
+                clones[i] = job.result()
+                print('[%d/%d] %s %s in %.1fs' 
+                      % (done, len(urls), actions[i], names[i],
+                         reporter.timings[(names[i], 'clone')]))
+            except Exception as error:
+                errors[names[i]] = error
+                print('[%d/%d] Failed %s' % (done, len(urls), names[i]))
+    
+    return clones, errors
+
+#==============================================================================
+# Status
+#==============================================================================
+
+# Read the output of git status --porcelain=v2 --branch into counts
+def parse_status(text):
+    '''
+    Summarise machine readable git status output
+    
+    Parameters
+    ----------
+    text : string
+        Output of git status --porcelain=v2 --branch.
+    
+    Returns
+    -------
+    out : dictionary
+        branch (None if detached), upstream, ahead, behind, and the number
+        of staged, dirty (changed but not staged), untracked and conflicted
+        files.
+    '''
+    
+    summary = {'branch': None, 'upstream': None, 'ahead': 0, 'behind': 0,
+               'staged': 0, 'dirty': 0, 'untracked': 0, 'conflicts': 0}
+    
+    for line in text.splitlines():
+        if line.startswith('# branch.head '):
+            head = line[len('# branch.head '):]
+            if head != '(detached)':
+                summary['branch'] = head
+        elif line.startswith('# branch.upstream '):
+            summary['upstream'] = line[len('# branch.upstream '):]
+        elif line.startswith('# branch.ab '):
+            ahead, behind = line[len('# branch.ab '):].split()
+            summary['ahead'] = int(ahead)
+            summary['behind'] = -int(behind)
+        elif line.startswith('1 ') or line.startswith('2 '):
+            if line[2] != '.':
+                summary['staged'] += 1
+            if line[3] != '.':
+                summary['dirty'] += 1
+        elif line.startswith('u '):
+            summary['conflicts'] += 1
+        elif line.startswith('? '):
+            summary['untracked'] += 1
+    return summary
+
+# Every path git status reports as changed, including both sides of a rename
+# and each untracked file on its own
+def changed_paths(repo):
+    fields = iter(repo.git.status('-z', porcelain=True, 
+                                  untracked_files='all').split('\0'))
+    paths = []
+    for field in fields:
+        if not field:
+            continue
+        paths.append(field[3:])
+        if field[0] in 'RC':
+            paths.append(next(fields))
+    return paths
+
+# Split paths into lists short enough for one command line (Windows allows 
+# about 32000 characters)
+def path_batches(paths, limit=8000):
+    batch = []
+    length = 0
+    for path in paths:
+        if batch and length + len(path) > limit:
+            yield batch
+            batch = []
+            length = 0
+        batch.append(path)
+        length += len(path) + 3
+    if batch:
+        yield batch
+
+# Modification times of the files git changes when the index, HEAD, the
+# current branch, the branch it follows on GitHub (which a push moves) or 
+# the remote branches move. A cached status is only good while these stay
+# the same.
+def status_key(repo):
+    # A worktree has its own index and HEAD, the branches are shared
+    git_dir = repo.git_dir
+    common_dir = repo.common_dir
+    names = [(git_dir, 'index'), (git_dir, 'HEAD'), 
+             (common_dir, 'FETCH_HEAD'), (common_dir, 'packed-refs'),
+             (common_dir, 'config')]   # where the branch it follows is set
+    
+    try:
+        with open(os.path.join(git_dir, 'HEAD')) as head:
+            line = head.read().strip()
+        if line.startswith('ref: '):
+            names.append((common_dir, line[5:]))
+    except OSError:
+        pass
+    
+    # e.g. refs/remotes/origin/dev, rewritten by a push and left out of 
+    # FETCH_HEAD and packed-refs
+    try:
+        tracking = BranchInfo(repo).tracking
+    except (ValueError, TypeError, OSError):
+        tracking = None
+    if tracking is not None:
+        names.append((common_dir, 'refs/remotes/' + tracking))
+    
+    key = []
+    for folder, name in names:
+        try:
+            key.append(os.stat(os.path.join(folder, name)).st_mtime_ns)
+        except OSError:
+            key.append(None)
+    return tuple(key)
+
+# Which branch a repository is on, read from HEAD ----------------------------
+class BranchInfo:
+    '''
+    The branch a repository is on, read straight from its HEAD file. No git
+    process is started, unlike git status.
+    
+    Parameters
+    ----------
+    repo : Repo
+        Repository to read.
+    
+    Notes
+    -----
+    branch is None when HEAD is detached, commit is None on a repository 
+    with no commits yet, and tracking is the remote branch it follows (e.g.
+    origin/dev) or None.
+    '''
+    
+    def __init__(self, repo):
+        self.detached = repo.head.is_detached
+        self.branch = None
+        self.tracking = None
+        
+        if not self.detached:
+            head = repo.active_branch
+            self.branch = head.name
+            remote = head.tracking_branch()
+            if remote is not None:
+                self.tracking = remote.name
+        
+        try:
+            self.commit = SymbolicReference.dereference_recursive(repo, 'HEAD')
+        except ValueError:
+            self.commit = None
+    
+    # True on a branch nothing may be committed to, see protected_branches
+    @property
+    def protected(self):
+        return self.branch in protected_branches
+    
+    def __repr__(self):
+        return '<BranchInfo %s %s>' % (self.branch or '(detached)', 
+                                       self.commit)
+
+# Message shown when an action is refused on a protected branch
+def protected_message(info):
+    return ('Action on ' + info.branch + ' branch forbidden. '
+            'Use choosebranch() function to change.')
+
+# Print the table made by Workspace.status_table
+def print_status_table(table):
+    width = max([len(x) for x in table] + [4])
+    print('Repo'.ljust(width) + '  Branch               Ahead Behind '
+          + 'Staged Dirty Untracked')
+    for x in table:
+        summary = table[x]
+        if 'error' in summary:
+            print(x.ljust(width) + '  FAILED  ' 
+                  + str(summary['error']).strip().replace('\n', ' '))
+            continue
+        branch = summary['branch'] or '(detached)'
+        print('%s  %-20s %5d %6d %6d %5d %9d' 
+              % (x.ljust(width), branch, summary['ahead'], summary['behind'],
+                 summary['staged'], summary['dirty'], summary['untracked']))
+    return
+
+#==============================================================================
+# Git sessions
+#==============================================================================
+
+class GitSession:
+    '''
+    Reads from one repository without starting a new git process each time.
+    
+    Revisions are looked up through a single git cat-file --batch process
+    that GitPython keeps open between calls, and the list of tracked files
+    is read from the index in Python, only again once the index changes.
+    
+    Parameters
+    ----------
+    repo : Repo
+        Repository to read.
+    '''
+    
+    def __init__(self, repo):
+        self.repo = repo
+        self.lock = threading.Lock()
+        self.index_time = None
+        self.paths = []
+        self.folders = []
+    
+    # Sha of each revision, or None where it does not exist, in one go
+    def resolve(self, *revs):
+        shas = []
+        with self.lock:
+            for rev in revs:
+                try:
+                    shas.append(self.repo.git.get_object_header(rev)[0]
+                                .decode('ascii'))
+                except ValueError:
+                    shas.append(None)
+        return shas
+    
+    # Tracked files and the folders holding them, re-read when the index is
+    def tracked(self):
+        index_time = os.stat(os.path.join(self.repo.git_dir, 
+                                          'index')).st_mtime_ns
+        if index_time != self.index_time:
+            paths = sorted(set(x[0] for x in IndexFile(self.repo).entries))
+            folders = set([''])
+            for path in paths:
+                folder = os.path.dirname(path)
+                while folder not in folders:
+                    folders.add(folder)
+                    folder = os.path.dirname(folder)
+            self.paths = paths
+            self.folders = sorted(folders)
+            self.index_time = index_time
+        return self.paths, self.folders
+
+#==============================================================================
+# Change watching
+#==============================================================================
+
+class ChangeWatcher:
+    '''
+    Remembers which files of each repository changed since they were last 
+    added, from file system events (inotify on Linux, through the watchdog
+    package), so nothing has to walk the working trees to find them.
+    
+    Each tree starts with the paths git status reports as changed, so 
+    edits made before watching began are kept. Events under .git, from 
+    git's own bookkeeping, are ignored.
+    
+    Notes
+    -----
+    Linux limits how many folders one user can watch 
+    (/proc/sys/fs/inotify/max_user_watches). A tree that cannot be watched
+    is left out and added and read the usual way.
+    '''
+    
+    def __init__(self):
+        self.observer = Observer()
+        self.lock = threading.Lock()
+        self.roots = {}
+        self.watches = {}
+        self.changed = {}
+        self.times = {}
+    
+    # Start watching a working tree, raises OSError if it cannot be watched
+    def watch(self, name, path):
+        root = os.path.abspath(path)
+        with self.lock:
+            self.roots[root] = name
+            self.changed.setdefault(name, set())
+            self.times[name] = time.monotonic()
+        if not self.observer.is_alive():
+            self.observer.start()
+        try:
+            self.watches[name] = self.observer.schedule(self, root, 
+                                                        recursive=True)
+        except Exception:
+            with self.lock:
+                del self.roots[root]
+            raise
+    
+    # Stop watching one working tree, and forget what changed in it
+    def forget(self, name):
+        watch = self.watches.pop(name)
+        self.observer.unschedule(watch)
+        with self.lock:
+            del self.roots[os.path.abspath(watch.path)]
+            self.changed.pop(name, None)
+            self.times.pop(name, None)
+    
+    def watching(self, name):
+        return name in self.watches
+    
+    def stop(self):
+        if self.observer.is_alive():
+            self.observer.stop()
+            self.observer.join()
+    
+    # Called by the observer for every event
+    def dispatch(self, event):
+        if event.event_type not in ('created', 'modified', 'deleted', 
+                                    'moved'):
+            return
+        # A folder is 'modified' whenever a file in it is, already recorded
+        if event.is_directory and event.event_type == 'modified':
+            return
+        
+        now = time.monotonic()
+        paths = [event.src_path, getattr(event, 'dest_path', '')]
+        with self.lock:
+            for path in paths:
+                found = self.locate(os.fsdecode(path)) if path else None
+                if found is None:
+                    continue
+                name, relative = found
+                if relative == '.' or '.git' in relative.split(os.sep):
+                    continue
+                self.changed[name].add(relative.replace(os.sep, '/'))
+                self.times[name] = now
+    
+    # Repository name and path within it of a watched file, or None
+    def locate(self, path):
+        folder = os.path.abspath(path)
+        while folder not in self.roots:
+            parent = os.path.dirname(folder)
+            if parent == folder:
+                return None
+            folder = parent
+        return self.roots[folder], os.path.relpath(path, folder)
+    
+    # Record paths as changed, e.g. ones an add could not stage
+    def keep(self, name, paths):
+        with self.lock:
+            self.changed[name].update(paths)
+            self.times[name] = time.monotonic()
+    
+    # Paths changed since the last take, forgotten once returned
+    def take(self, name):
+        with self.lock:
+            paths = self.changed[name]
+            self.changed[name] = set()
+        return sorted(paths)
+    
+    # time.monotonic() of the last change seen
+    def last_change(self, name):
+        return self.times[name]
+
+#==============================================================================
+# Importing files
+#==============================================================================
+
+FICLONE = 0x40049409   # Linux ioctl giving a new file the data of another
+
+# Files to import from a folder or a glob pattern, e.g. 'edits/**/*.c', and
+# the folder their paths are read from (the pattern up to its first wildcard)
+def import_sources(source):
+    if os.path.isdir(source):
+        base = source
+        files = []
+        for folder, folders, names in os.walk(source):
+            folders[:] = [x for x in folders if x != '.git']
+            files += [os.path.join(folder, x) for x in names]
+    else:
+        parts = re.split(r'[\\/]', source)
+        fixed = 0
+        while fixed < len(parts) - 1 and not re.search(r'[*?[]', 
+                                                       parts[fixed]):
+            fixed += 1
+        base = '/'.join(parts[:fixed]) or '.'
+        files = [x for x in glob.glob(source, recursive=True) 
+                 if os.path.isfile(x)]
+    files = [x for x in files 
+             if '.git' not in os.path.relpath(x, base).split(os.sep)]
+    return base, sorted(files)
+
+# Give destination the data of source without copying it, where the file 
+# system shares blocks between files (Btrfs, XFS). False if it cannot.
+def reflink_file(source, destination):
+    if fcntl is None:
+        return False
+    with open(source, 'rb') as src, open(destination, 'wb') as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        except OSError:
+            return False
+    return True
+
+# Copy a file in blocks, then read the copy back and compare checksums
+def copy_verified(source, destination, block_size=1024**2):
+    digest = hashlib.sha256()
+    with open(source, 'rb') as src, open(destination, 'wb') as dst:
+        for block in iter(lambda: src.read(block_size), b''):
+            digest.update(block)
+            dst.write(block)
+    
+    check = hashlib.sha256()
+    with open(destination, 'rb') as dst:
+        for block in iter(lambda: dst.read(block_size), b''):
+            check.update(block)
+    if check.digest() != digest.digest():
+        raise OSError('Copy of ' + source + ' does not match it')
+
+def transfer_file(source, destination, move=True, hardlink=False):
+    '''
+    Put a file into a repository in the cheapest way the disks allow
+    
+    Parameters
+    ----------
+    source : string
+        File to bring in.
+        
+    destination : string
+        Where it goes, replacing any file already there. Missing folders 
+        are made.
+        
+    move : bool
+        Remove the source once it is in place.
+        
+    hardlink : bool
+        When copying, a hard link to the source may be made instead, so 
+        both names share one file and editing one edits the other.
+    
+    Returns
+    -------
+    out : string
+        How it was done: 'renamed' (a move on the same disk), 'reflinked',
+        'hardlinked' or 'copied'.
+    
+    Notes
+    -----
+    Anything but a rename is written beside the destination first and only
+    renamed onto it once complete, so an interrupted import never leaves a
+    partly written file in the repository.
+    '''
+    
+    folder = os.path.dirname(destination)
+    os.makedirs(folder, exist_ok=True)
+    if move:
+        try:
+            os.replace(source, destination)
+            return 'renamed'
+        except OSError:
+            pass
+    
+    partial = os.path.join(folder, '.' + os.path.basename(destination) 
+                           + '.import')
+    try:
+        if reflink_file(source, partial):
+            how = 'reflinked'
+        elif hardlink and not move:
+            if os.path.lexists(partial):
+                os.remove(partial)
+            try:
+                os.link(source, partial)
+                how = 'hardlinked'
+            except OSError:
+                copy_verified(source, partial)
+                how = 'copied'
+        else:
+            copy_verified(source, partial)
+            how = 'copied'
+        if how != 'hardlinked':
+            shutil.copystat(source, partial)
+        os.replace(partial, destination)
+    except BaseException:
+        if os.path.lexists(partial):
+            os.remove(partial)
+        raise
+    
+    if move:
+        os.remove(source)
+    return how
+
+#==============================================================================
+# Shared libraries
+#==============================================================================
+
+# True if two paths name the same folder
+def same_folder(first, second):
+    return (os.path.normcase(os.path.abspath(first)) 
+            == os.path.normcase(os.path.abspath(second)))
+
+# Folder and branch (None if detached) of every checkout of a repository: 
+# the clone itself first, then its worktrees
+def checkouts(repo):
+    found = []
+    for line in repo.git.worktree('list', '--porcelain').splitlines():
+        if line.startswith('worktree '):
+            found.append([line[len('worktree '):], None])
+        elif line.startswith('branch refs/heads/'):
+            found[-1][1] = line[len('branch refs/heads/'):]
+    return [tuple(x) for x in found]
+
+class Registry:
+    '''
+    The projects opened under one folder and the library checkouts each 
+    uses, kept in a JSON file so sessions running side by side, in this 
+    process or others, know about each other.
+    
+    Each library is cloned once, to Libs//<library>, and every project that
+    has it on the same branch uses that checkout. A project changing a 
+    library to a branch it is not on elsewhere, while other projects use 
+    its checkout, gets a git worktree Libs//<library>@<branch> instead
+    (with / in the branch written %2F). A worktree shares the clone's 
+    objects, so nothing is cloned or fetched twice, and the other projects
+    are left on their branch.
+    
+    Parameters
+    ----------
+    path : string
+        The JSON file.
+    '''
+    
+    def __init__(self, path):
+        self.path = path
+    
+    # Only one session changes the file at a time. A lock older than the 
+    # timeout is taken to be left by a session that stopped, and taken over.
+    @contextlib.contextmanager
+    def locked(self, timeout=10):
+        lock = self.path + '.lock'
+        folder = os.path.dirname(self.path)
+        if folder and not os.path.isdir(folder):
+            os.makedirs(folder)
+        
+        deadline = time.time() + timeout
+        while True:
+            try:
+                handle = os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                break
+            except FileExistsError:
+                if time.time() > deadline:
+                    with contextlib.suppress(OSError):
+                        os.remove(lock)
+                    deadline = time.time() + timeout
+                time.sleep(0.05)
+        try:
+            yield
+        finally:
+            os.close(handle)
+            os.remove(lock)
+    
+    def read(self):
+        try:
+            with open(self.path, 'r') as saved:
+                return json.load(saved)
+        except (OSError, ValueError):
+            return {'projects': {}}
+    
+    # Written beside the file first, so a reader never sees half of it
+    def write(self, data):
+        with open(self.path + '.new', 'w') as saved:
+            json.dump(data, saved, indent=1)
+        os.replace(self.path + '.new', self.path)
+    
+    # Library name -> checkout folder, as last used by a project
+    def libraries(self, project):
+        return self.read()['projects'].get(project, {}).get('libraries', {})
+    
+    # Projects other than the one given that use a checkout
+    def users(self, path, project=None):
+        projects = self.read()['projects']
+        return [x for x in projects if x != project and any(
+            same_folder(path, y) for y in projects[x]['libraries'].values())]
+    
+    def update(self, project, libraries):
+        with self.locked():
+            data = self.read()
+            data['projects'][project] = {
+                'libraries': libraries, 
+                'updated': time.strftime('%Y-%m-%d %H:%M:%S')}
+            self.write(data)
+    
+    def remove(self, project):
+        with self.locked():
+            data = self.read()
+            data['projects'].pop(project, None)
+            self.write(data)
+
+#==============================================================================
+# Background fetching
+#==============================================================================
+
+class Prefetcher:
+    '''
+    Fetches every repository of a workspace on a background thread, every 
+    interval seconds, so that fetches, pulls and pushes started by hand 
+    find most objects they need already downloaded.
+    
+    Like git maintenance's prefetch, the GitHub branches are fetched into
+    refs/prefetch/ and FETCH_HEAD is not written: origin/<branch>, the 
+    branches and the working trees never change under the session, so 
+    cached status stays good. Worktrees of one clone are fetched once.
+    
+    A repository that fails to fetch is tried again after twice the wait 
+    each time, up to an hour (or the interval if longer), with some 
+    randomness so failures do not all retry at once.
+    
+    Parameters
+    ----------
+    workspace : Workspace
+        Repositories to fetch.
+        
+    interval : float
+        Seconds between fetches of each repository.
+        
+    workers : int
+        Number of repositories fetched at the same time.
+    '''
+    
+    refspec = '+refs/heads/*:refs/prefetch/remotes/origin/*'
+    
+    def __init__(self, workspace, interval, workers):
+        self.workspace = workspace
+        self.interval = interval
+        self.workers = workers
+        self.state = {}
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.thread = None
+    
+    def start(self):
+        if self.thread is None or not self.thread.is_alive():
+            self.stopping.clear()
+            self.thread = threading.Thread(target=self.loop, daemon=True,
+                                           name='prefetch')
+            self.thread.start()
+        return self
+    
+    # Waits for a fetch already running to end
+    def stop(self):
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+    
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+    
+    def targets(self):
+        return self.workspace.clones()
+    
+    def loop(self):
+        with ThreadPoolExecutor(max_workers=max(1, self.workers)) as pool:
+            while not self.stopping.is_set():
+                now = time.time()
+                due = [x for x in self.targets() 
+                       if self.state.get(x, {}).get('next', 0) <= now]
+                for job in [pool.submit(self.fetch, x) for x in due]:
+                    job.result()
+                
+                with self.lock:
+                    times = [self.state[x]['next'] for x in self.state]
+                wait = min(times + [time.time() + self.interval]) - time.time()
+                self.stopping.wait(max(1.0, wait))
+    
+    def fetch(self, name):
+        if self.stopping.is_set():
+            return
+        record = dict(self.state.get(name, {'fetched': None, 'seconds': None,
+                                             'failures': 0, 'error': None}))
+        started = time.time()
+        entry = self.workspace.index[name]
+        try:
+            remote_call(entry.url, 'fetch', entry.repo.git.fetch,
+                        'origin', self.refspec, '--prune', '--no-tags', 
+                        '--quiet', '--no-write-fetch-head', '--refmap=')
+            record['fetched'] = time.time()
+            record['failures'] = 0
+            record['error'] = None
+            wait = self.interval
+        except Exception as error:
+            record['failures'] += 1
+            record['error'] = error_line(error)
+            wait = min(self.interval * 2 ** record['failures'], 
+                       max(self.interval, 3600))
+            wait *= random.uniform(0.8, 1.2)
+        record['seconds'] = time.time() - started
+        record['next'] = time.time() + wait
+        with self.lock:
+            self.state[name] = record
+    
+    # Copy of the state of every repository: time fetched, seconds taken, 
+    # failures in a row, last error and time of the next fetch
+    def status(self):
+        with self.lock:
+            return dict((x, dict(self.state[x])) for x in self.state)
+
+#==============================================================================
+# Project and libraries
+#==============================================================================
+
+# Names of the libraries listed in the project's Lib file
+def read_lib_file(repo_list):
+    libs_extract = find_lib_file(repo_list)
+    with open(libs_extract, "r") as libs_required:
+        libraries = libs_required.readlines()
+    return [x.strip('\n') for x in libraries]
+
+# The project's Lib file, among the files in its top folder
+def find_lib_file(repo_list):
+    libs_file = filter(lambda x: 'Lib' in x, repo_list)
+    return ''.join(str(e) for e in libs_file)
+
+# sha256 of a file's contents
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as opened:
+        for block in iter(lambda: opened.read(1024**2), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+# Commit HEAD is at, read from the files in .git without running git. None
+# if there are no commits yet.
+def head_commit(repo):
+    try:
+        return SymbolicReference.dereference_recursive(repo, 'HEAD')
+    except ValueError:
+        return None
+
+# Kind of checkout a folder holds, 'clone' or 'worktree', and the folder's 
+# inode, so one deleted and cloned again is noticed. None if not a checkout.
+def checkout_layout(path):
+    try:
+        inode = os.stat(path).st_ino
+    except OSError:
+        return None
+    git = os.path.join(path, '.git')
+    if os.path.isdir(git):
+        return ['clone', inode]
+    if os.path.isfile(git):
+        return ['worktree', inode]
+    return None
+
+def library_manifest(repo):
+    '''
+    The libraries a library needs, from the Lib .txt file in its top folder
+    
+    Parameters
+    ----------
+    repo : Repo
+        Library checkout. The file is read from its HEAD commit, so sparse
+        checkouts that leave it out still work.
+    
+    Returns
+    -------
+    out : sha, names
+        Git sha of the Lib file and the library names listed in it, or None
+        and [] if the library has no Lib file.
+    '''
+    
+    try:
+        tree = repo.head.commit.tree
+    except ValueError:
+        return None, []
+    
+    for blob in tree.blobs:
+        if 'Lib' in blob.name and blob.name.endswith('.txt'):
+            text = blob.data_stream.read().decode('utf-8', 'replace')
+            names = [x.strip() for x in text.splitlines()]
+            return blob.hexsha, [x for x in dict.fromkeys(names) if x]
+    return None, []
+
+# One repository in the workspace
+class RepoEntry:
+    '''
+    A project or library repository of the workspace
+    
+    Parameters
+    ----------
+    name : string
+        Name the repository is known by, e.g. DmiAdc.
+        
+    repo : Repo
+        GitPython handle of the local checkout.
+        
+    path : string
+        Folder of the local checkout.
+        
+    url : string
+        GitHub URL it was cloned from.
+        
+    kind : string
+        'project' or 'library'.
+    
+    Notes
+    -----
+    metadata is a dictionary for anything worth remembering about the 
+    repository during the session, e.g. cached status. session is the 
+    GitSession used for reads.
+    '''
+    
+    def __init__(self, name, repo, path, url, kind):
+        self.name = name
+        self.repo = repo
+        self.path = path
+        self.url = url
+        self.kind = kind
+        self.metadata = {}
+        self.session = GitSession(repo)
+    
+    def __repr__(self):
+        return '<RepoEntry %s %s>' % (self.name, self.path)
+
+class Workspace:
+    '''
+    A project and its libraries, checked out in the local working directory.
+    
+    Nothing is cloned or fetched until open() is called, so a Workspace can
+    be made from another script without any prompts, e.g.
+        
+        ws = Workspace('MyProject').open()
+        ws.add('DmiAdc')
+        ws.commit('DmiAdc', 'Fix ADC gain')
+        ws.push('DmiAdc')
+    
+    Parameters
+    ----------
+    project : string
+        Project name, the suffix of its GitHub URL.
+        
+    prefix : string
+        Folder the project and libraries are kept in. Defaults to 
+        directoryprefix.
+        
+    base_url : string
+        GitHub address the project and libraries live under. Defaults to 
+        base_URL.
+    '''
+    
+    def __init__(self, project, prefix=None, base_url=None):
+        self.project = project
+        self.prefix = prefix or directoryprefix
+        self.base_url = base_url or base_URL
+        self.project_URL = self.base_url + project
+        self.local_directory = self.prefix + 'project//' + project + '/'
+        self.library_directory = self.prefix + 'Libs//'
+        self.clone_options = library_clone_options.get(
+            project, library_clone_options['default'])
+        
+        self.progress = ProgressReporter(printing=show_progress)
+        self.proj = None
+        self.repo_list = []
+        self.lib_URL = []
+        self.clone_errors = {}
+        self.opened = False
+        
+        # Library -> libraries it needs, and the libraries level by level:
+        # the project's own first, then those they need, and so on
+        self.graph = {}
+        self.levels = []
+        self.graph_file = self.prefix + 'Cache//' + project + '-libraries.json'
+        
+        # Where every repository was left, for the next session to start 
+        # from, see load_manifest
+        self.manifest_file = (self.prefix + 'Cache//' + project 
+                              + '-workspace.json')
+        
+        # Commits of every library, next to the Lib file. Its name must not
+        # contain 'Lib' or it would be taken for the Lib file.
+        self.lock_file = self.local_directory + 'libraries.lock'
+        
+        # Name -> RepoEntry, libraries first then the project, plus aliases
+        self.index = {}
+        self.aliases = dict(repo_aliases)
+        
+        # Names and Repo objects in index order, the old parallel lists
+        self.libraries = []
+        self.libs = []
+        
+        # ChangeWatcher of the working trees, while watch_files is on
+        self.watcher = None
+        
+        # Prefetcher running in the background, if started
+        self.prefetcher = None
+        
+        # Fetch of a reopened workspace, see fetch_behind
+        self.fetching = None
+        self.fetch_errors = {}
+        
+        # Library checkouts of every project under prefix, see Registry
+        self.registry = None
+        if share_libraries:
+            self.registry = Registry(self.prefix + 'workspaces.json')
+    
+    # Clone (or attach) the project and its libraries. Safe to call again.
+    def open(self):
+        if self.opened:
+            return self
+        
+        reopened = fast_startup and attach_existing and self.load_manifest()
+        if not reopened:
+            self.build()
+        self.opened = True
+        self.save_registry()
+        self.save_manifest()
+        atexit.register(self.save_manifest)
+        
+        if restore_from_lock and os.path.isfile(self.lock_file):
+            print('Restoring libraries from ' + self.lock_file + '...')
+            print_table(self.restore_lock())
+        
+        if watch_files:
+            self.watch()
+        if prefetch_minutes:
+            self.prefetch(prefetch_minutes)
+        if reopened and fetch_on_reopen:
+            self.fetch_behind()
+        return self
+    
+    # Clone or attach and fetch every repository, reading the Lib files
+    def build(self):
+        if attach_existing and is_checkout(self.local_directory):
+            print('Attaching project...')
+        else:
+            print('Cloning project...')
+        self.proj = self.progress.run(self.project, 'clone', attach_or_clone,
+                                      self.project_URL, self.local_directory)
+        
+        # Extracting libraries information
+        print('Cloning libraries...')
+        self.repo_list = glob.glob(self.local_directory+'*')
+        libraries = read_lib_file(self.repo_list)
+        
+        # Blank lines and libraries listed twice are only cloned once
+        libraries = [x for x in dict.fromkeys(libraries) if x]
+        
+        clones = self.resolve(libraries)
+        self.lib_URL = [self.library_url(x) for x in clones]
+        
+        # Libraries this project last used a worktree of go back to it
+        shared = {}
+        if self.registry is not None:
+            shared = self.registry.libraries(self.project)
+        
+        # Failed libraries are left out of the index
+        for library in clones:
+            name = library
+            full_name = 'firmware_library_' + name
+            
+            # A library sharing the project's name goes by its full name
+            if name == self.project:
+                print(name + ' is also the project, library renamed to ' 
+                      + full_name)
+                name = full_name
+            else:
+                self.aliases.setdefault(full_name, name)
+            
+            repo = clones[library]
+            path = self.library_directory + library
+            if name in shared and not same_folder(shared[name], path) \
+                    and is_checkout(shared[name]):
+                path = shared[name]
+                repo = open_repo(path)
+            self.register(RepoEntry(name, repo, path, 
+                                    self.library_url(library), 'library'))
+        
+        if self.clone_errors:
+            print('The following libraries could not be cloned:')
+            for name in self.clone_errors:
+                print('    ' + name + ': ' + str(self.clone_errors[name]))
+        
+        if use_mirror_cache:
+            evict_mirrors(mirror_cache_size)
+        
+        self.register(RepoEntry(self.project, self.proj, self.local_directory,
+                                self.project_URL, 'project'))
+        self.aliases.setdefault('project', self.project)
+    
+    def load_manifest(self):
+        '''
+        Open every repository from manifest_file, without cloning, fetching 
+        or reading any Lib file, if nothing has changed since it was saved
+        
+        Returns
+        -------
+        out : bool
+            False, with nothing opened, if the manifest is missing or out of
+            date: the project's Lib file differs (read only if its time or
+            size changed), GitHub address differs, a checkout was removed, 
+            replaced or turned into a worktree, or HEAD moved in any 
+            repository since this script last saw it.
+        
+        Notes
+        -----
+        Every check reads file times and files in .git, no git process is
+        started. GitHub's changes are fetched afterwards, in the background,
+        see fetch_behind.
+        '''
+        
+        try:
+            with open(self.manifest_file, 'r') as saved:
+                manifest = json.load(saved)
+            if manifest['base_url'] != self.base_url:
+                return False
+            
+            # The folder only changes time when a file in it is added, 
+            # removed or renamed, so a new Lib file shows
+            repo_list = manifest['repo_list']
+            if (os.stat(self.local_directory).st_mtime_ns 
+                    != manifest['folder_time']):
+                repo_list = glob.glob(self.local_directory+'*')
+            lib_file = find_lib_file(repo_list)
+            if lib_file != manifest['lib_file']['path']:
+                return False
+            info = os.stat(lib_file)
+            if ([info.st_mtime_ns, info.st_size] != manifest['lib_file']['stat']
+                    and file_sha256(lib_file) 
+                    != manifest['lib_file']['sha256']):
+                return False
+            
+            entries = []
+            for record in manifest['repositories']:
+                if checkout_layout(record['path']) != record['layout']:
+                    return False
+                repo = open_repo(record['path'])
+                if head_commit(repo) != record['head']:
+                    return False
+                entries.append((RepoEntry(record['name'], repo, record['path'],
+                                          record['url'], record['kind']), 
+                                record['aliases']))
+        except (OSError, ValueError, KeyError, TypeError):
+            return False
+        
+        print('Opening ' + self.project + ' as last left...')
+        for entry, aliases in entries:
+            self.register(entry)
+            for alias in aliases:
+                self.aliases.setdefault(alias, entry.name)
+        self.proj = self.index[self.project].repo
+        self.repo_list = repo_list
+        self.lib_URL = [self.index[x].url for x in self.index 
+                        if self.index[x].kind == 'library']
+        self.graph = manifest['graph']
+        self.levels = manifest['levels']
+        return True
+    
+    # Record the checkouts for load_manifest. Called when the workspace 
+    # opens and again when the session ends, so HEADs moved by the session
+    # itself do not count as changes next time.
+    def save_manifest(self):
+        try:
+            if self.clone_errors:
+                # Failed libraries are cloned again next time
+                if os.path.isfile(self.manifest_file):
+                    os.remove(self.manifest_file)
+                return
+            
+            lib_file = find_lib_file(self.repo_list)
+            info = os.stat(lib_file)
+            repositories = []
+            for name in self.index:
+                entry = self.index[name]
+                repositories.append({
+                    'name': name, 'path': entry.path, 'url': entry.url, 
+                    'kind': entry.kind, 'head': head_commit(entry.repo),
+                    'layout': checkout_layout(entry.path),
+                    'aliases': [x for x in self.aliases 
+                                if self.aliases[x] == name 
+                                and x not in repo_aliases]})
+            manifest = {
+                'base_url': self.base_url,
+                'folder_time': os.stat(self.local_directory).st_mtime_ns,
+                'repo_list': self.repo_list,
+                'lib_file': {'path': lib_file, 'sha256': file_sha256(lib_file),
+                             'stat': [info.st_mtime_ns, info.st_size]},
+                'graph': self.graph,
+                'levels': self.levels,
+                'repositories': repositories}
+            
+            folder = os.path.dirname(self.manifest_file)
+            if not os.path.isdir(folder):
+                os.makedirs(folder)
+            with open(self.manifest_file + '.new', 'w') as saved:
+                json.dump(manifest, saved, indent=1)
+            os.replace(self.manifest_file + '.new', self.manifest_file)
+        except OSError:
+            # e.g. the workspace folder was removed before the session ended
+            pass
+    
+    # GitHub URL of a library
+    def library_url(self, name):
+        return self.base_url + 'firmware_library_' + name + '.git'
+    
+    # Clone or attach some libraries in parallel, adding them to clones
+    def clone_level(self, names, clones):
+        if not names:
+            return
+        urls = [self.library_url(x) for x in names]
+        results, errors = clone_libraries(urls, names, self.library_directory,
+                                          clone_workers, self.clone_options,
+                                          self.progress)
+        self.clone_errors.update(errors)
+        for i in range(len(names)):
+            if results[i] is not None:
+                clones[names[i]] = results[i]
+    
+    def resolve(self, direct):
+        '''
+        Clone the libraries the project needs, the libraries those need in
+        turn, and so on
+        
+        Each level is cloned in parallel before its Lib files are read for
+        the next. A library needed by several others is cloned once, and a
+        loop of libraries needing each other ends when it comes back round.
+        
+        The graph is saved in graph_file. If the project's Lib file has not
+        changed since, every library in it is cloned (or attached) in one
+        go, and the levels are only worked out again if one of their Lib 
+        files has changed.
+        
+        Parameters
+        ----------
+        direct : list
+            Libraries named in the project's Lib file.
+        
+        Returns
+        -------
+        out : clones
+            Dictionary of library name to Repo, level by level. Libraries
+            that failed to clone are left out, see clone_errors.
+        '''
+        
+        clones = {}
+        cached = self.load_graph(direct)
+        if cached is not None:
+            names = [x for level in cached['levels'] for x in level]
+            self.clone_level(names, clones)
+            
+            # A library missing from manifests failed to clone when it was
+            # saved, so what it needs was never read
+            current = True
+            for x in clones:
+                if (x not in cached['manifests'] or 
+                        library_manifest(clones[x])[0] 
+                        != cached['manifests'][x]):
+                    current = False
+            if current:
+                self.graph = cached['graph']
+                self.levels = cached['levels']
+                return clones
+            print('Library dependencies have changed, checking them again...')
+        
+        self.graph = {}
+        self.levels = []
+        manifests = {}
+        seen = set()
+        level = list(direct)
+        
+        while level:
+            missing = [x for x in level if x not in clones]
+            if self.levels and missing:
+                print('Cloning libraries needed by other libraries...')
+            seen.update(level)
+            self.clone_level(missing, clones)
+            self.levels.append(level)
+            
+            following = []
+            for name in level:
+                if name not in clones:
+                    continue
+                manifests[name], self.graph[name] = library_manifest(
+                    clones[name])
+                for x in self.graph[name]:
+                    if x not in seen and x not in following:
+                        following.append(x)
+            level = following
+        
+        self.save_graph(direct, manifests)
+        
+        # Libraries cloned from an out of date graph may no longer be needed
+        return dict((x, clones[x]) for level in self.levels for x in level 
+                    if x in clones)
+    
+    # The saved library graph, if the project's Lib file still matches it
+    def load_graph(self, direct):
+        if not cache_library_graph:
+            return None
+        try:
+            with open(self.graph_file, 'r') as saved:
+                cached = json.load(saved)
+        except (OSError, ValueError):
+            return None
+        if cached.get('direct') != direct:
+            return None
+        return cached
+    
+    def save_graph(self, direct, manifests):
+        if not cache_library_graph:
+            return
+        if self.clone_errors:
+            # Failed libraries are read and saved next time
+            if os.path.isfile(self.graph_file):
+                os.remove(self.graph_file)
+            return
+        folder = os.path.dirname(self.graph_file)
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        with open(self.graph_file, 'w') as saved:
+            json.dump({'direct': direct, 'levels': self.levels, 
+                       'graph': self.graph, 'manifests': manifests}, 
+                      saved, indent=1)
+    
+    # Record the checkout of each library in the registry
+    def save_registry(self):
+        if self.registry is None:
+            return
+        self.registry.update(self.project, dict(
+            (x, self.index[x].path) for x in self.index 
+            if self.index[x].kind == 'library'))
+    
+    # Stop sharing: drop this project from the registry, so its libraries
+    # no longer count as used by it
+    def leave(self):
+        if self.registry is not None:
+            self.registry.remove(self.project)
+    
+    def placement(self, name, branch):
+        '''
+        Where a library has to go to be on a branch without changing the
+        branch other projects have it on
+        
+        Parameters
+        ----------
+        name : string
+            Library name.
+            
+        branch : string
+            Branch it is to be on.
+        
+        Returns
+        -------
+        out : tuple or None
+            None to change branch in the current checkout. Otherwise 
+            (folder, joining): joining is True if the folder is another 
+            checkout already on the branch, False if it is a new worktree 
+            to make. Raises ValueError if the new worktree's folder is 
+            taken.
+        '''
+        
+        entry = self.index[name]
+        if self.registry is None or entry.kind != 'library':
+            return None
+        
+        found = checkouts(entry.repo)
+        for path, on in found:
+            if on == branch and not same_folder(path, entry.path):
+                return path, True
+        if not self.registry.users(entry.path, self.project):
+            return None
+        
+        # Escaped, not just '/' replaced, so a/b and a-b get folders of 
+        # their own. A folder already there is in use, found above if it
+        # were on the branch.
+        path = found[0][0] + '@' + urllib.parse.quote(branch, safe='')
+        if os.path.exists(path):
+            raise ValueError(path + ' is already there, on another branch')
+        return path, False
+    
+    # Point a library at another checkout of it, e.g. a worktree
+    def move_library(self, name, path):
+        entry = self.index[name]
+        watched = self.watcher is not None and self.watcher.watching(name)
+        if watched:
+            self.watcher.forget(name)
+        
+        entry.repo = open_repo(path)
+        entry.path = path
+        entry.session = GitSession(entry.repo)
+        entry.metadata = {}
+        self.libs[self.libraries.index(name)] = entry.repo
+        
+        if watched:
+            self.watcher.watch(name, path)
+            self.watcher.keep(name, changed_paths(entry.repo))
+        return entry
+    
+    # Add a repository to the index
+    def register(self, entry):
+        if entry.name in self.index:
+            raise ValueError('Two repositories are called ' + entry.name)
+        self.index[entry.name] = entry
+        self.libraries.append(entry.name)
+        self.libs.append(entry.repo)
+        return entry
+    
+    def entry(self, name):
+        '''
+        Find a repository by name, alias or the start of its name
+        
+        Parameters
+        ----------
+        name : string
+            Repository name (e.g. DmiAdc), an alias from repo_aliases, or 
+            enough of the start of a name to pick out just one repository.
+            Case is ignored for aliases and partial names.
+        
+        Returns
+        -------
+        out : RepoEntry
+            Raises KeyError if nothing, or more than one repository, matches.
+        '''
+        
+        self.open()
+        if name in self.index:
+            return self.index[name]
+        if name in self.aliases:
+            return self.index[self.aliases[name]]
+        
+        lowered = name.lower()
+        for alias in self.aliases:
+            if alias.lower() == lowered:
+                return self.index[self.aliases[alias]]
+        
+        matches = [x for x in self.index if x.lower().startswith(lowered)]
+        if len(matches) == 1:
+            return self.index[matches[0]]
+        if matches:
+            raise KeyError(name + ' could be any of ' + ', '.join(matches))
+        raise KeyError('No repository called ' + name)
+    
+    # Repo object of a project or library, by name
+    def repo(self, name):
+        return self.entry(name).repo
+    
+    # Status text of git status
+    def status(self, name):
+        return self.repo(name).git.status()
+    
+    # Branch the repository is on, see BranchInfo
+    def branch_info(self, name):
+        return BranchInfo(self.repo(name))
+    
+    def summary(self, name, refresh=False):
+        '''
+        Branch, ahead/behind and file counts of one repository
+        
+        Parameters
+        ----------
+        name : string
+            Repository name (e.g. DmiAdc).
+            
+        refresh : bool
+            Ask git even if the cached summary still looks current.
+        
+        Returns
+        -------
+        out : dictionary
+            See parse_status. The summary is cached on the repository entry 
+            and reused while the index, HEAD and branches are untouched, 
+            for status_cache_seconds: edits not yet added only show once it
+            runs out, or with refresh=True. A repository being watched (see
+            watch) needs neither: its cache holds until a file changes.
+        '''
+        
+        entry = self.entry(name)
+        key = status_key(entry.repo)
+        cached = entry.metadata.get('status')
+        watched = self.watcher is not None and self.watcher.watching(
+            entry.name)
+        
+        # Taken before git status runs, so changes made meanwhile are seen
+        checked = time.monotonic()
+        
+        if not refresh and cached is not None and cached['key'] == key:
+            if watched:
+                if cached['checked'] > self.watcher.last_change(entry.name):
+                    return cached['summary']
+            elif time.time() - cached['time'] < status_cache_seconds:
+                return cached['summary']
+        
+        text = entry.repo.git.status(porcelain='v2', branch=True)
+        summary = parse_status(text)
+        
+        # git status may rewrite the index itself, so the key is read again
+        key = status_key(entry.repo)
+        entry.metadata['status'] = {'key': key, 'time': time.time(),
+                                    'checked': checked, 'summary': summary}
+        return summary
+    
+    # Summaries of every repository, collected in parallel
+    def status_table(self, refresh=False):
+        self.open()
+        table = {}
+        with ThreadPoolExecutor(max_workers=max(1, fanout_workers)) as pool:
+            jobs = [(x, pool.submit(self.summary, x, refresh)) 
+                    for x in self.index]
+            for x, job in jobs:
+                try:
+                    table[x] = job.result()
+                except Exception as error:
+                    table[x] = {'error': error}
+        return table
+    
+    # Add files to local branch. Only the files seen changing if watched.
+    def add(self, name):
+        entry = self.entry(name)
+        if self.watcher is None or not self.watcher.watching(entry.name):
+            return entry.repo.git.add('.')
+        
+        paths = self.watcher.take(entry.name)
+        try:
+            return self.add_paths(entry.name, paths)
+        except Exception:
+            self.watcher.keep(entry.name, paths)
+            raise
+    
+    def add_paths(self, name, paths):
+        '''
+        Add (or remove, if deleted) only the given files and folders
+        
+        Parameters
+        ----------
+        name : string
+            Repository name (e.g. DmiAdc).
+            
+        paths : list
+            Paths relative to the top of the repository.
+        
+        Returns
+        -------
+        out : string
+            Output of git add, '' if there was nothing to add, in which case
+            git is not run at all.
+        
+        Notes
+        -----
+        git add stops on a path it does not know of, or one .gitignore
+        excludes, when it is named on its own, so paths created and deleted 
+        again, and ignored ones, are left out first.
+        '''
+        
+        entry = self.entry(name)
+        tracked, folders = entry.session.tracked()
+        known = set(tracked).union(folders)
+        
+        paths_to_add = []
+        untracked = []
+        for path in paths:
+            if os.path.lexists(os.path.join(entry.path, path)):
+                if path in known:
+                    paths_to_add.append(path)
+                else:
+                    untracked.append(path)
+            elif path in known:
+                paths_to_add.append(path)
+        
+        # check-ignore exits with 1 when nothing is ignored
+        ignored = set()
+        for batch in path_batches(untracked):
+            ignored.update(entry.repo.git.check_ignore(
+                '--', *batch, with_exceptions=False).splitlines())
+        paths_to_add += [x for x in untracked if x not in ignored]
+        
+        output = []
+        for batch in path_batches(paths_to_add):
+            output.append(entry.repo.git.add('--all', '--', *batch))
+        return '\n'.join(x for x in output if x)
+    
+    # Repository and path within it of a file being imported, from its path
+    # below the folder imported from. Raises KeyError if there is none.
+    def route(self, path, name=None):
+        if name is not None:
+            return self.entry(name).name, path
+        for start in sorted(import_routes, key=len, reverse=True):
+            if path.startswith(start):
+                name, folder = import_routes[start]
+                return self.exact_name(name), folder + path[len(start):]
+        first, _, rest = path.partition('/')
+        if not rest:
+            raise KeyError(path)
+        return self.exact_name(first), rest
+    
+    # Repository a folder name routes to: a name or alias exactly as it is, 
+    # never the partial or case-blind matches entry allows, which could 
+    # send files into the wrong repository
+    def exact_name(self, name):
+        if name in self.index:
+            return self.index[name].name
+        if name in self.aliases:
+            return self.index[self.aliases[name]].name
+        raise KeyError(name)
+    
+    def import_files(self, source, name=None, move=None):
+        '''
+        Bring a batch of files into the repositories and add them
+        
+        Parameters
+        ----------
+        source : string
+            Folder to import everything from, or a glob pattern, e.g. 
+            'C:/edits/**/*.c'.
+            
+        name : string
+            Repository every file goes into, keeping its path below source.
+            If not given each file is routed by import_routes, or else by 
+            the first folder of its path.
+            
+        move : bool
+            Move the files rather than copying them. Defaults to 
+            import_mode.
+        
+        Returns
+        -------
+        out : results table
+            fan_out style table with a 'note' per repository saying how 
+            many files were brought in and how. The repositories are done in
+            parallel, and each gets one git add of just its imported files.
+            
+        Notes
+        -----
+        Every file is routed before any is moved, so a file that belongs 
+        to no repository (a KeyError) stops the import with nothing done.
+        See transfer_file for how each file is moved or copied.
+        '''
+        
+        self.open()
+        if move is None:
+            move = import_mode == 'move'
+        
+        base, files = import_sources(source)
+        plan = {}
+        unknown = []
+        for path in files:
+            relative = os.path.relpath(path, base).replace(os.sep, '/')
+            try:
+                target, inside = self.route(relative, name)
+            except KeyError:
+                unknown.append(relative)
+                continue
+            plan.setdefault(target, []).append((path, inside))
+        if unknown:
+            raise KeyError('No repository for ' + ', '.join(unknown))
+        
+        def bring(target):
+            entry = self.index[target]
+            counts = {}
+            paths = []
+            try:
+                for path, inside in plan[target]:
+                    how = transfer_file(path, os.path.join(entry.path, inside),
+                                        move, import_hardlinks)
+                    counts[how] = counts.get(how, 0) + 1
+                    paths.append(inside)
+            finally:
+                if paths:
+                    self.add_paths(target, paths)
+            return counts
+        
+        table = fan_out(bring, list(plan))
+        for x in table:
+            counts = table[x]['result']
+            if counts:
+                table[x]['note'] = '%d files (%s)' % (
+                    sum(counts.values()), 
+                    ', '.join('%d %s' % (counts[y], y) for y in counts))
+        return table
+    
+    def watch(self):
+        '''
+        Watch every working tree, so add and summary only look at the files
+        seen changing, and repositories where none did cost no git process
+        
+        Returns
+        -------
+        out : bool
+            False if the watchdog package is not installed.
+        
+        Notes
+        -----
+        Started by open() when watch_files is on. The watchers stop with 
+        the session, or with unwatch().
+        '''
+        
+        if Observer is None:
+            print('Watching files needs the watchdog package '
+                  '(pip install watchdog)')
+            return False
+        self.open()
+        if self.watcher is None:
+            self.watcher = ChangeWatcher()
+        
+        names = [x for x in self.index if not self.watcher.watching(x)]
+        for name in names:
+            try:
+                self.watcher.watch(name, self.index[name].path)
+            except OSError as error:
+                print('Could not watch ' + name + ': ' + str(error))
+        
+        # Read after the watch starts, so nothing changed in between is lost
+        print('Watching ' + str(len(names)) + ' repositories...')
+        with ThreadPoolExecutor(max_workers=max(1, fanout_workers)) as pool:
+            jobs = [(x, pool.submit(changed_paths, self.index[x].repo)) 
+                    for x in names if self.watcher.watching(x)]
+            for x, job in jobs:
+                try:
+                    self.watcher.keep(x, job.result())
+                except Exception as error:
+                    print('Could not watch ' + x + ': ' + str(error))
+                    self.watcher.forget(x)
+        return True
+    
+    # Fetch every repository in the background every so many minutes, see
+    # Prefetcher. 0 stops it.
+    # One repository name for each clone, worktrees share their clone's
+    def clones(self):
+        found = {}
+        for name in list(self.index):
+            repo = self.index[name].repo
+            found.setdefault(os.path.normcase(repo.common_dir), name)
+        return list(found.values())
+    
+    # Fetch every clone on a background thread, as attaching would have, 
+    # so origin/<branch> is current soon after a fast startup. Failures 
+    # are kept in fetch_errors, not printed over the session.
+    def fetch_behind(self):
+        def fetch_quietly(name):
+            entry = self.index[name]
+            remote_call(entry.url, 'fetch', entry.repo.remote('origin').fetch,
+                        prune=True)
+        
+        def run():
+            with ThreadPoolExecutor(max_workers=max(1, clone_workers)) as pool:
+                jobs = [(x, pool.submit(fetch_quietly, x)) 
+                        for x in self.clones()]
+                for x, job in jobs:
+                    try:
+                        job.result()
+                        self.fetch_errors.pop(x, None)
+                    except Exception as error:
+                        self.fetch_errors[x] = error
+        
+        self.fetching = threading.Thread(target=run, daemon=True, 
+                                         name='fetch-behind')
+        self.fetching.start()
+        return self.fetching
+    
+    def prefetch(self, minutes):
+        if self.prefetcher is not None:
+            self.prefetcher.stop()
+            self.prefetcher = None
+        if minutes:
+            self.prefetcher = Prefetcher(self, minutes * 60, prefetch_workers)
+            self.prefetcher.start()
+        return self.prefetcher
+    
+    # Stop watching, add and summary go back to looking at whole trees
+    def unwatch(self):
+        if self.watcher is not None:
+            self.watcher.stop()
+            self.watcher = None
+    
+    # Commit changes to local branch
+    def commit(self, name, message):
+        return self.repo(name).git.commit(m = message)
+    
+    # Push to remote branch
+    def push(self, name):
+        entry = self.entry(name)
+        origin = entry.repo.remote('origin')
+        
+        # GitPython keeps a rejected push's error rather than raising it
+        def push_checked(**kwargs):
+            result = origin.push(**kwargs)
+            result.raise_if_error()
+            return result
+        
+        return self.progress.run(name, 'push', remote_call, entry.url, 'push',
+                                 push_checked)
+    
+    # Fetch from GitHub without touching the working tree
+    async def fetch_async(self, name):
+        entry = self.entry(name)
+        return await run_git(entry.repo, 'fetch', '--prune', 'origin', 
+                             remote=entry.url)
+    
+    def fetch(self, name):
+        entry = self.entry(name)
+        origin = entry.repo.remote('origin')
+        return self.progress.run(name, 'fetch', remote_call, entry.url, 
+                                 'fetch', origin.fetch, prune=True)
+    
+    # Coroutine versions, see AsyncEngine --------------------------------------
+    async def add_async(self, name):
+        entry = self.entry(name)
+        if self.watcher is not None and self.watcher.watching(entry.name):
+            # Runs git itself, on a thread so the other repositories go on
+            return await asyncio.to_thread(self.add, name)
+        return await run_git(entry.repo, 'add', '.')
+    
+    async def commit_async(self, name, message):
+        return await run_git(self.repo(name), 'commit', '-m', message)
+    
+    async def push_async(self, name):
+        entry = self.entry(name)
+        return await run_git(entry.repo, 'push', '--porcelain', 'origin', 
+                             remote=entry.url)
+    
+    # change_branch runs its own event loop, so it gets a thread
+    async def branch_async(self, name, branch):
+        return await asyncio.to_thread(self.branch, name, branch)
+    
+    async def checkout_async(self, name, branch):
+        return await asyncio.to_thread(self.checkout, name, branch)
+    
+    # Create identical local and remote (on GitHub) branch
+    def branch(self, name, branch):
+        return self.change_one(name, branch, create=True)
+    
+    # Checkout a branch tracking the one on GitHub
+    def checkout(self, name, branch):
+        return self.change_one(name, branch, create=False)
+    
+    # change_branch for one repository, so a library checkout other projects
+    # use is not switched under them. Raises its error if it fails.
+    def change_one(self, name, branch, create):
+        name = self.entry(name).name
+        table = self.change_branch(branch, [name], create, allow_dirty=True)
+        error = table[name]['error']
+        if isinstance(error, Exception):
+            raise error
+        if error is not None:
+            raise RuntimeError(error)
+        return table[name]['note']
+    
+    def change_branch(self, branch, names=None, create=True, 
+                      allow_dirty=False):
+        '''
+        Create (or check out) a branch in many repositories as one change
+        
+        Every repository is checked first, and nothing is changed if any 
+        fails the checks. The change is then made in all of them in 
+        parallel. If it fails in any repository, every repository that was
+        changed is put back as it was, also in parallel: the previous 
+        branch is checked out again, the new local branch deleted, and a 
+        branch this change pushed to GitHub deleted there. A branch someone
+        else made on GitHub is never pushed to, and so never deleted.
+        
+        Parameters
+        ----------
+        branch : string
+            Branch name.
+            
+        names : list
+            Repositories to change, all of them if not given.
+            
+        create : bool
+            True to create the branch here and on GitHub (newbranch), False
+            to check out the existing GitHub branch (choosebranch).
+            
+        allow_dirty : bool
+            Go ahead in repositories with changed files.
+        
+        Returns
+        -------
+        out : results table
+            fan_out style table with a 'note' per repository saying what 
+            happened to it.
+        
+        Notes
+        -----
+        A library whose checkout other projects use is not changed under 
+        them. It joins another project's checkout already on the branch, 
+        or gets a worktree of its own, see Registry and placement.
+        '''
+        
+        self.open()
+        names = list(self.index) if names is None else [self.entry(x).name 
+                                                        for x in names]
+        places = {}
+        moved = {}
+        
+        # Checks --------------------------------------------------------------
+        def check(name):
+            entry = self.entry(name)
+            repo = entry.repo
+            
+            # Asked of GitHub, the origin/ refs here may be out of date
+            listing = remote_call(entry.url, 'fetch', repo.git.ls_remote, 
+                                  '--heads', 'origin', branch)
+            remote_exists = 'refs/heads/' + branch in [
+                x.split('\t')[-1] for x in listing.splitlines()]
+            
+            place = self.placement(name, branch)
+            joining = place is not None and place[1]
+            if place is not None:
+                places[name] = place
+            
+            if branch in repo.heads and (create or not joining):
+                raise ValueError('branch ' + branch + ' already exists here')
+            if create and remote_exists:
+                raise ValueError('branch ' + branch + ' already on GitHub')
+            if not create and not remote_exists:
+                raise ValueError('no branch ' + branch + ' on GitHub')
+            
+            if not allow_dirty:
+                summary = self.summary(name, True)
+                if summary['staged'] + summary['dirty'] + summary['conflicts']:
+                    raise ValueError('has uncommitted changes')
+            
+            info = BranchInfo(repo)
+            return info.branch or info.commit
+        
+        checks = fan_out(check, names)
+        if any(checks[x]['error'] is not None for x in checks):
+            for x in checks:
+                if checks[x]['error'] is None:
+                    checks[x]['note'] = 'not changed'
+                else:
+                    checks[x]['note'] = ''
+            print('Nothing was changed, fix these first:')
+            return checks
+        
+        # Change --------------------------------------------------------------
+        steps = dict((x, []) for x in names)
+        
+        async def apply(name):
+            if name in places:
+                path, joining = places[name]
+                if not joining:
+                    await run_git(self.repo(name), 'worktree', 'add', 
+                                  '--detach', path, 'HEAD')
+                    steps[name].append('worktree')
+                moved[name] = self.index[name].path
+                self.move_library(name, path)
+                steps[name].append('moved')
+                if joining:
+                    return
+            
+            entry = self.index[name]
+            if create:
+                await run_git(entry.repo, 'branch', branch)
+                steps[name].append('head')
+                await run_git(entry.repo, 'checkout', branch)
+                steps[name].append('checkout')
+                # Refused if someone has made the branch since the checks, 
+                # so the rollback only ever deletes a branch made here
+                output = await run_git(
+                    entry.repo, 'push', '--porcelain', '--set-upstream', 
+                    '--force-with-lease=%s:' % branch, 'origin', branch, 
+                    remote=entry.url)
+                # '*' is a new branch, '=' one already there at this commit
+                flags = [x.split('\t')[0] for x in output.splitlines() 
+                         if x.count('\t') >= 2 and x.split('\t')[1] 
+                         .endswith(':refs/heads/' + branch)]
+                if flags != ['*']:
+                    raise ValueError('branch ' + branch + ' already on GitHub')
+                steps[name].append('push')
+            else:
+                await run_git(entry.repo, 'fetch', 'origin', 
+                              '+refs/heads/%s:refs/remotes/origin/%s' 
+                              % (branch, branch), remote=entry.url)
+                await run_git(entry.repo, 'checkout', '-b', branch, 
+                              'origin/' + branch)
+                steps[name].append('head')
+                steps[name].append('checkout')
+        
+        table = fan_out_coroutine(apply, names)
+        failed = [x for x in table if table[x]['error'] is not None]
+        if not failed:
+            for x in table:
+                table[x]['note'] = ('created and pushed' if create 
+                                    else 'checked out')
+                if x in moved:
+                    table[x]['note'] += ' in ' + self.index[x].path
+            self.save_registry()
+            return table
+        
+        # Roll back -----------------------------------------------------------
+        # The previous branch may be checked out where the library was moved
+        # from, so a moved one is detached instead, then moved back
+        async def undo(name):
+            entry = self.index[name]
+            if 'checkout' in steps[name]:
+                if 'moved' in steps[name]:
+                    await run_git(entry.repo, 'checkout', '--detach')
+                else:
+                    await run_git(entry.repo, 'checkout', 
+                                  checks[name]['result'])
+            if 'head' in steps[name]:
+                await run_git(entry.repo, 'branch', '-D', branch)
+            if 'push' in steps[name]:
+                await run_git(entry.repo, 'push', '--delete', 'origin', branch,
+                              remote=entry.url)
+            if 'moved' in steps[name]:
+                self.move_library(name, moved[name])
+            if 'worktree' in steps[name]:
+                await run_git(self.index[name].repo, 'worktree', 'remove', 
+                              places[name][0])
+        
+        changed = [x for x in names if steps[x]]
+        undone = fan_out_coroutine(undo, changed)
+        self.save_registry()
+        for x in table:
+            if x in failed:
+                table[x]['note'] = ''
+            elif x not in undone:
+                table[x]['note'] = 'not changed'
+            elif undone[x]['error'] is None:
+                table[x]['note'] = 'rolled back'
+            else:
+                table[x]['error'] = ('rollback failed: ' 
+                                     + str(undone[x]['error']))
+        print('Failed in %d repositories, the rest were rolled back:' 
+              % len(failed))
+        return table
+    
+    # Add an annotated tag
+    def tag(self, name, tagname, message):
+        return self.repo(name).create_tag(tagname, message=message)
+    
+    def write_lock(self):
+        '''
+        Record the commit every library is at in lock_file
+        
+        Returns
+        -------
+        out : lock
+            Dictionary written to the file: for each library its URL, the
+            sha of its checked out commit and the branch it is on (None if
+            detached).
+        '''
+        
+        self.open()
+        lock = {'project': self.project, 'libraries': {}}
+        for name in self.index:
+            entry = self.index[name]
+            if entry.kind != 'library':
+                continue
+            info = BranchInfo(entry.repo)
+            lock['libraries'][name] = {'url': entry.url, 'sha': info.commit,
+                                       'branch': info.branch}
+        
+        with open(self.lock_file, 'w') as saved:
+            json.dump(lock, saved, indent=1, sort_keys=True)
+        return lock
+    
+    # Check one library out at the commit recorded for it
+    def restore_library(self, name, record):
+        entry = self.entry(name)
+        repo = entry.repo
+        sha = record['sha']
+        
+        # Only fetch when the commit is not here already, and then just it
+        if entry.session.resolve(sha + '^{commit}')[0] is None:
+            flags = {}
+            if self.clone_options.get('depth'):
+                flags['depth'] = self.clone_options['depth']
+            if use_mirror_cache and not flags:
+                mirror = update_mirror(record['url'])
+                repo.git.fetch(mirror.git_dir, sha)
+            else:
+                remote_call(entry.url, 'fetch', repo.git.fetch, 'origin', sha,
+                            **flags)
+        
+        # Stay on the recorded branch if it is still at the commit
+        branch = record.get('branch')
+        if branch in repo.heads and repo.heads[branch].commit.hexsha == sha:
+            return repo.git.checkout(branch)
+        return repo.git.checkout(sha)
+    
+    def restore_lock(self):
+        '''
+        Check every library out at the commit recorded in lock_file
+        
+        Returns
+        -------
+        out : results table
+            fan_out table of the libraries in the lock file. Commits already
+            in a library are used as they are, others are fetched by sha 
+            alone (through the mirror cache if it is on). A library is left
+            on its recorded branch if that branch is still at the commit, 
+            otherwise HEAD is detached at it.
+        '''
+        
+        self.open()
+        with open(self.lock_file, 'r') as saved:
+            lock = json.load(saved)
+        records = lock['libraries']
+        return fan_out(lambda x: self.restore_library(x, records[x]), 
+                       list(records))
+    
+    def sync(self, message, names=None):
+        '''
+        Add, commit and push every repository that has changes, in parallel
+        
+        Parameters
+        ----------
+        message : string
+            Commit message used in every repository that is committed.
+            
+        names : list
+            Repositories to consider, all of them if not given.
+        
+        Returns
+        -------
+        out : results table
+            fan_out style table with a 'note' per repository saying what was
+            done. Each repository's status is read once (in parallel) to 
+            decide: 
+            repositories with changed files are added, committed and
+            pushed, those only ahead of GitHub are pushed, and clean ones,
+            or ones on a protected or detached branch, are skipped without 
+            running anything else.
+        '''
+        
+        self.open()
+        names = self.index if names is None else [self.entry(x).name 
+                                                  for x in names]
+        
+        with ThreadPoolExecutor(max_workers=max(1, fanout_workers)) as pool:
+            jobs = [(x, pool.submit(self.summary, x, True)) 
+                    for x in names]
+        
+        table = {}
+        commits = []
+        pushes = []
+        for x, job in jobs:
+            table[x] = {'result': None, 'error': None, 'seconds': 0.0}
+            try:
+                summary = job.result()
+            except Exception as error:
+                table[x]['error'] = error
+                continue
+            
+            changed = (summary['staged'] + summary['dirty'] 
+                       + summary['untracked'])
+            if summary['branch'] is None:
+                table[x]['note'] = 'detached HEAD, skipped'
+            elif summary['branch'] in protected_branches and (
+                    changed or summary['ahead']):
+                table[x]['note'] = 'on ' + summary['branch'] + ', skipped'
+            elif summary['conflicts']:
+                table[x]['error'] = 'has unresolved conflicts'
+            elif changed:
+                commits.append(x)
+            elif summary['ahead']:
+                pushes.append(x)
+            else:
+                table[x]['note'] = 'clean, skipped'
+        
+        def add_commit_push(name):
+            self.add(name)
+            self.commit(name, message)
+            self.push(name).raise_if_error()
+        
+        def push_only(name):
+            self.push(name).raise_if_error()
+        
+        done = fan_out(add_commit_push, commits)
+        done.update(fan_out(push_only, pushes))
+        for x in done:
+            table[x] = done[x]
+            if done[x]['error'] is None:
+                table[x]['note'] = ('committed and pushed' if x in commits 
+                                    else 'pushed')
+        return table
 
 #==============================================================================
-# Project and libraries
+# Session
 #==============================================================================
 
-print('')
-print('Ensure that input is in quotation marks...')
-
-# User input section ----------------------------------------------------------
-project = input("Project Name:")
-project_URL = 'https://github.com/DigicoUK/' + project
-
-###############################################################################
-directoryprefix = 'Z://new_work_area_12/'
-local_directory = directoryprefix + 'project//' + project + '/'
-###############################################################################
-
-print('Cloning project...')
-proj = Repo.clone_from(project_URL, local_directory)
-
-# Extracting libraries information --------------------------------------------
-print('Cloning libraries...')
-repo_list = glob.glob(local_directory+'*')
-
-libs_file = filter(lambda x: 'Lib' in x, repo_list)
-libs_extract = ''.join(str(e) for e in libs_file)
-libs_required = open(libs_extract, "r")
-
-libraries = libs_required.readlines()
-libraries = [x.strip('\n') for x in libraries]
-
-# Names of required project libraries' URLs -----------------------------------
-lib_URL = []
+# The workspace the functions below act on, and the callable parameters
+# copied from it by start()
+workspace = None
+project = None
+project_URL = None
+local_directory = None
+proj = None
+repo_list = []
+libraries = []
+libs = []
 
-for i in range(len(libraries)):
-    lib_URL.append('https://github.com/DigicoUK/firmware_library_' 
-                     +  libraries[i] + '.git')
+def start(name=None):
+    '''
+    Open the project to work on, cloning it and its libraries as needed
     
-# Automatic cloning of the libraries
-libs = []
-for i in range(len(lib_URL)):
-    libs.append(Repo.clone_from(lib_URL[i],
-                                directoryprefix + 'Libs//' 
-                                + libraries[i]))
+    Parameters
+    ----------
+    name : string
+        Project name. Asked for if not given.
+    
+    Returns
+    -------
+    out : workspace
+        The Workspace used by every function in this script from now on.
+    '''
+    
+    global workspace, project, project_URL, local_directory
+    global proj, repo_list, libraries, libs
+    
+    if name is None:
+        print('Ensure that input is in quotation marks...')
+        name = input("Project Name:")
+    
+    workspace = Workspace(name).open()
+    
+    project = workspace.project
+    project_URL = workspace.project_URL
+    local_directory = workspace.local_directory
+    proj = workspace.proj
+    repo_list = workspace.repo_list
+    libraries = workspace.libraries
+    libs = workspace.libs
+    return workspace
+
+# Workspace of this session, started the first time it is needed
+def get_workspace():
+    if workspace is None:
+        start()
+    return workspace
 
-libs.append(proj)
-libraries.append(project)
 #==============================================================================
 # Function section 
 #==============================================================================
@@ -138,9 +3420,9 @@ The function section is split into three parts:
     2. User Functions
     3. Compound functions
     
-Atomic functions rely entirely on the lists of files and repository paths, and
-the arguments input. Debugging should begin here, as the other functions are 
-logical interpretations of these. 
+Atomic functions hand the work to the Workspace of the session, see start().
+Debugging should begin here, as the other functions are logical 
+interpretations of these. 
 
 User functions each follow the same logic format. These are unlikely to break
 in the result of bugs being found, and it is these functions which are brought
@@ -151,74 +3433,172 @@ up large volumes of adds/commits to multiple branches in multiple repo's.
 
 
 """
-print('-----------------------------------------------')
-print('Type contents() for a list of functions.')
-print('Type workflow() for help in functional logic.')
 
 #==============================================================================
 # Atomic functions
 #==============================================================================
 
+# Run a Workspace operation, e.g. 'push', on the engine execution_engine 
+# chooses: the method itself, or its coroutine (push_async) with asyncio
+def operation(name, repository, *args):
+    if execution_engine == 'asyncio':
+        return run_async(getattr(get_workspace(), name + '_async')(repository,
+                                                                   *args))
+    return getattr(get_workspace(), name)(repository, *args)
+
 # Create identical local and remote (on GitHub) branch.
 def branch_creator(repository, branch):
-    
-    j = libraries.index(repository)
-    f = libs[j]
-    
-    f.create_head(branch)
-    f.git.checkout(branch)
-    
-    origin = f.remote('origin')
-    remote_branch = origin.git.push('origin',branch)
-    return remote_branch
+    return operation('branch', repository, branch)
 
 # Add files to local branch
 def git_add(repository):
-    
-    j = libraries.index(repository)
-    f = libs[j]
-    
-    add_changes = f.git.add('.')    
-    return add_changes
+    return operation('add', repository)
 
 # Commit changes to local branch
 def git_commit(repository, message):
-    
-    j = libraries.index(repository)
-    f = libs[j]
-    
-    make_commit = f.git.commit(m = message)    
-    return make_commit
+    return operation('commit', repository, message)
 
 # Push to remote branch
 def git_push(repository):
-    
-    j = libraries.index(repository)
-    f = libs[j]
-    
-    origin = f.remote('origin')
-    push_to = origin.push()   
-    return push_to
+    return operation('push', repository)
 
 # Checkout branch
 def git_checkout(repository, branch):
-    
-    j = libraries.index(repository)
-    f = libs[j]
-    
-    selection = f.git.checkout('origin/'+branch, b = branch)    
-    return selection
+    return operation('checkout', repository, branch)
 
 # Add tags
 def tag_maker(repository):
     tagname = input('Tag name:')
     tagmessage = input('Tag description:')
+    return get_workspace().tag(repository, tagname, tagmessage)
+
+#==============================================================================
+# Fan-out
+#==============================================================================
+
+# Run an atomic function over several repositories at once
+def fan_out(function, repositories, *args):
+    '''
+    Apply an atomic function to each repository in parallel
+    
+    Parameters
+    ----------
+    function : function
+        Atomic function taking the repository name as its first argument,
+        e.g. git_push.
+        
+    repositories : list
+        Repository names the function is applied to.
+        
+    args : 
+        Any further arguments passed on to the function, e.g. a branch name.
+    
+    Returns
+    -------
+    out : results table
+        Dictionary mapping each repository to {'result': ..., 'error': ..., 
+        'seconds': ...}, in the same order as repositories. A failed 
+        repository has its exception under 'error' and does not stop the 
+        others.
+    '''
+    
+    # Each job times itself, so time spent queueing is not counted
+    def timed(x):
+        started = time.time()
+        try:
+            return function(x, *args), None, time.time() - started
+        except Exception as error:
+            return None, error, time.time() - started
+    
+    table = {}
+    with ThreadPoolExecutor(max_workers=max(1, fanout_workers)) as pool:
+        jobs = [(x, pool.submit(timed, x)) for x in repositories]
+        for x, job in jobs:
+            result, error, seconds = job.result()
+            table[x] = {'result': result, 'error': error, 'seconds': seconds}
+    return table
+
+def fan_out_async(function, repositories, *args):
+    '''
+    Apply a coroutine function to each repository, all at once on one 
+    thread, see AsyncEngine
+    
+    Parameters
+    ----------
+    function : coroutine function
+        Taking the repository name as its first argument, e.g. a Workspace's
+        push_async.
+        
+    repositories : list
+        Repository names the function is applied to.
+        
+    args : 
+        Any further arguments passed on to the function.
+    
+    Returns
+    -------
+    out : results table
+        As fan_out. Ctrl+C stops every repository still running, killing 
+        its git command, and the table is returned with those marked 
+        'cancelled'.
+    '''
+    
+    table = dict((x, {'result': None, 'error': None, 'seconds': 0.0}) 
+                 for x in repositories)
     
-    j = libraries.index(repository)
-    f = libs[j]
+    async def timed(x):
+        started = time.time()
+        try:
+            table[x]['result'] = await function(x, *args)
+        except asyncio.CancelledError:
+            table[x]['error'] = 'cancelled'
+            raise
+        except Exception as error:
+            table[x]['error'] = error
+        finally:
+            table[x]['seconds'] = time.time() - started
     
-    new_tag = f.create_tag(tagname, message=tagmessage)    
-    return new_tag
+    async def everything():
+        await asyncio.gather(*[timed(x) for x in repositories])
+    
+    try:
+        run_async(everything())
+    except KeyboardInterrupt:
+        print('Cancelled, the git commands still running were stopped.')
+    return table
+
+# fan_out for a coroutine function: all at once with the asyncio engine, or 
+# each in its own event loop on the thread pool
+def fan_out_coroutine(function, repositories, *args):
+    if execution_engine == 'asyncio':
+        return fan_out_async(function, repositories, *args)
+    return fan_out(lambda x, *y: asyncio.run(function(x, *y)), repositories,
+                   *args)
+
+# fan_out of a Workspace operation, e.g. 'push', on the chosen engine
+def fan_out_operation(name, repositories, *args):
+    if execution_engine == 'asyncio':
+        return fan_out_async(getattr(get_workspace(), name + '_async'), 
+                             repositories, *args)
+    return fan_out(getattr(get_workspace(), name), repositories, *args)
+
+# Print one line per repository from a fan_out results table
+def print_table(table):
+    width = max([len(x) for x in table] + [0])
+    failed = 0
+    for x in table:
+        error = table[x]['error']
+        seconds = '%6.1fs' % table[x].get('seconds', 0)
+        if error is None:
+            print(x.ljust(width) + seconds + '  ok  ' 
+                  + table[x].get('note', ''))
+        else:
+            failed += 1
+            print(x.ljust(width) + seconds + '  FAILED  ' 
+                  + str(error).strip().replace('\n', ' '))
+    print('%d of %d repositories done, %d failed.' 
+          % (len(table) - failed, len(table), failed))
+    return
 
 #==============================================================================
 # User functions
@@ -241,22 +3621,41 @@ def status(repo):
         
     Notes
     -----
-    This function cannot be used under the 'all' function. Use it only for 
-    individual repositories.
+    Under 'all' this prints the dashboard() table of every repository 
+    instead.
     '''      
     
     if repo == 'all':
-        return 
+        return dashboard()
     else:
-        j = libraries.index(repo)        
-        f = libs[j]
-    
-        status = f.git.status()
-        if 'branch master' in status:
-            print('Action on master branch forbidden. Use choosebranch() function to change.')
+        info = get_workspace().branch_info(repo)
+        if info.protected:
+            print(protected_message(info))
             return
         else:               
-            return status
+            return get_workspace().status(repo)
+
+def dashboard(refresh=False):
+    '''
+    One table with the status of every repository in the workspace
+    
+    Parameters
+    ----------
+    refresh : bool
+        Run git status in every repository, even those with a cached status
+        that still looks current. Only needed after editing files that have
+        not been added yet.
+    
+    Returns
+    -------
+    out : status table
+        Dictionary mapping each repository to its branch, commits ahead of
+        and behind GitHub, and number of staged, dirty and untracked files
+    '''
+    
+    table = get_workspace().status_table(refresh)
+    print_status_table(table)
+    return table
 
 def newbranch(repo):
     '''
@@ -278,8 +3677,9 @@ def newbranch(repo):
     
     if repo == 'all':
         print('This may take a moment...')
-        for x in libraries:
-            branch_creator(x, branchname)
+        table = get_workspace().change_branch(branchname, create=True)
+        print_table(table)
+        return table
     else:     
         branch_creator(repo, branchname)
     return
@@ -305,8 +3705,9 @@ def choosebranch(repo):
     
     if repo == 'all':
         print('This may take a moment...')
-        for x in libraries:
-            git_checkout(x, branchname)
+        table = get_workspace().change_branch(branchname, create=False)
+        print_table(table)
+        return table
     else:     
         git_checkout(repo, branchname)
     return
@@ -332,6 +3733,39 @@ def tag(repo):
     return
 
 
+def lock():
+    '''
+    Write the commit each library is at to the project's libraries.lock file
+    
+    Returns
+    -------
+    out : lock
+        The libraries with their URL, commit and branch. Commit the file to
+        the project so the same library commits can be restored later.
+    '''
+    
+    locked = get_workspace().write_lock()
+    print('%d libraries locked in %s' % (len(locked['libraries']), 
+                                         get_workspace().lock_file))
+    return locked
+
+def restore():
+    '''
+    Check every library out at the commit in the project's libraries.lock
+    
+    Returns
+    -------
+    out : results table
+        Outcome for each library. Only commits that are not already local 
+        are fetched.
+    '''
+    
+    print('This may take a moment...')
+    table = get_workspace().restore_lock()
+    print_table(table)
+    return table
+
+
 def add(repo):
     '''
     Add files into the new local repository. This stages them for the first 
@@ -354,12 +3788,52 @@ def add(repo):
 
     if repo == 'all':
         print('This may take a moment...')
-        for x in libraries:
-            git_add(x)      
+        table = fan_out_operation('add', get_workspace().libraries)
+        print_table(table)
+        return table
     else:     
         git_add(repo)
     return
 
+def move2repo(source, repo=None):
+    '''
+    Move edited or new files into the local repositories, and add them
+    
+    Parameters
+    ----------
+    source : string
+        Folder holding the files, or a glob pattern e.g. 'C:/edits/*.c'. 
+        Below it, each file's first folder names its repository, e.g. 
+        C:/edits/DmiAdc/src/adc.c goes to src/adc.c in DmiAdc (see 
+        import_routes for other layouts).
+        
+    repo : string
+        Repository name (e.g. DmiAdc) every file goes into instead.
+    
+    Returns
+    -------
+    out : results table
+        Files imported into each repository, already staged.
+        
+    Notes
+    -----
+    Files are moved, or copied if import_mode is 'copy'. This must be 
+    followed by commit(repo).
+    '''
+    
+    try:
+        table = get_workspace().import_files(source, repo)
+    except KeyError as error:
+        print(error.args[0] if error.args else error)
+        print('Nothing was imported. Name the repository with repo=, or '
+              'add the folder to import_routes.')
+        return None
+    if not table:
+        print('No files found in ' + source)
+    else:
+        print_table(table)
+    return table
+
 
 def commit(repo):
     '''
@@ -384,8 +3858,9 @@ def commit(repo):
     
     if repo == 'all':
         print('This may take a moment...')
-        for x in libraries:
-            git_commit(x, msg)
+        table = fan_out_operation('commit', get_workspace().libraries, msg)
+        print_table(table)
+        return table
     else:     
         git_commit(repo, msg)
     return
@@ -408,12 +3883,100 @@ def push(repo):
 
     if repo == 'all':
         print('This may take a moment...')
-        for x in libraries:
-            git_push(x)
+        table = fan_out_operation('push', get_workspace().libraries)
+        print_table(table)
+        return table
     else:     
         git_push(repo)
     return
 
+def fetch(repo):
+    '''
+    Fetch GitHub's changes without touching the working tree
+    
+    Parameters
+    ----------
+    repo : string
+        Repository name (e.g. DmiAdc) command is intended to be applied to,
+        or 'all'.
+    
+    Returns
+    -------
+    out : fetch
+        origin/<branch> of every branch brought up to date, so dashboard and
+        choosebranch see what colleagues have pushed.
+    '''
+    
+    if repo == 'all':
+        print('This may take a moment...')
+        table = fan_out_operation('fetch', list(get_workspace().index))
+        print_table(table)
+        return table
+    else:
+        return operation('fetch', repo)
+
+def prefetch(minutes=None):
+    '''
+    Keep fetching every repository in the background, so choosebranch, 
+    push and the like find most of what they need already downloaded
+    
+    Parameters
+    ----------
+    minutes : float
+        Minutes between fetches of each repository, 0 to stop. Defaults to
+        prefetch_minutes, or 30 if that is 0.
+    
+    Returns
+    -------
+    out : prefetcher
+        The Prefetcher now running, None if stopped. Working trees, 
+        branches and origin/<branch> are never changed by it.
+    '''
+    
+    if minutes is None:
+        minutes = prefetch_minutes or 30
+    prefetcher = get_workspace().prefetch(minutes)
+    if prefetcher is None:
+        print('Background fetching stopped.')
+    else:
+        print('Fetching every repository every %g minutes.' % minutes)
+    return prefetcher
+
+def prefetch_status():
+    '''
+    Show what the background fetching has done
+    
+    Returns
+    -------
+    out : dictionary
+        Repository -> fetched (time), seconds, failures (in a row), error 
+        and next (time), see Prefetcher.status. None if not running.
+    '''
+    
+    prefetcher = get_workspace().prefetcher
+    if prefetcher is None or not prefetcher.running():
+        print('Background fetching is not running, start it with prefetch()')
+        return None
+    
+    state = prefetcher.status()
+    now = time.time()
+    width = max([len(x) for x in state] + [0])
+    for x in state:
+        line = x.ljust(width)
+        if state[x]['fetched'] is None:
+            line += '  never fetched'
+        else:
+            line += '  fetched %4dm ago in %.1fs' % (
+                (now - state[x]['fetched']) / 60, state[x]['seconds'])
+        line += ', next in %dm' % max(0, (state[x]['next'] - now) / 60)
+        if state[x]['error']:
+            line += ', failed %d times: %s' % (state[x]['failures'], 
+                                               state[x]['error'])
+        print(line)
+    if not state:
+        print('No fetch has finished yet.')
+    return state
+
 #==============================================================================
 # Compound Functions
 #==============================================================================
@@ -443,31 +4006,489 @@ def compush(repo):
     
     message = input('Message to commit:')
     
-    if 'branch master' in status(repo):
-        print('Action on master branch forbidden. Use choosebranch() function to change.')
+    info = get_workspace().branch_info(repo)
+    if info.protected:
+        print(protected_message(info))
         return
     
-    j = libraries.index(repo)
-    f = libs[j]
+    f = get_workspace().repo(repo)
       
     f.git.commit(m = message)
-    origin = f.remote('origin')
-    commit_and_push = origin.push()    
+    commit_and_push = git_push(repo)
     return commit_and_push
 
 def monty(repo):
     
     message = input('Message to commit:')
 
-    if 'branch master' in status(repo):
-        print('Action on master branch forbidden. Use choosebranch() function to change.')
+    info = get_workspace().branch_info(repo)
+    if info.protected:
+        print(protected_message(info))
         return
             
-    j = libraries.index(repo)
-    f = libs[j]
+    f = get_workspace().repo(repo)
     
     f.git.add('.')  
     f.git.commit(m = message)
-    origin = f.remote('origin')
-    add_commit_push = origin.push() 
-    return add_commit_push
\ No newline at end of file
+    add_commit_push = git_push(repo)
+    return add_commit_push
+
+def sync():
+    '''
+    Add, commit and push every repository with changes, all at once
+    
+    Parameters
+    ----------
+    message : string
+        Asked for. The same commit message is used in every repository.
+    
+    Returns
+    -------
+    out : results table
+        What was done in each repository. Repositories without changes, and
+        those on master, are skipped.
+    '''
+    
+    message = input('Message to commit:')
+    
+    print('This may take a moment...')
+    table = get_workspace().sync(message)
+    print_table(table)
+    return table
+
+#==============================================================================
+# Benchmark
+#==============================================================================
+"""
+
+The benchmark times the workspace operations against repositories made on
+the local disk, standing in for GitHub, so changes to this script can be 
+measured rather than guessed. Run it with
+
+    python "TomScript v2.1.py" --benchmark --libraries 30 --output bench.json
+
+Each operation is timed with one worker (serial) and with --workers workers
+(parallel). The repositories are read as files unless --transport http, git
+or ssh serves them, which also tries the connection settings. See 
+python "TomScript v2.1.py" --benchmark --help for the rest.
+
+"""
+
+# A bare repository with made up history, written with git fast-import
+def make_history(path, commits, files, file_size, rng):
+    Repo.init(path, bare=True)
+    
+    stream = io.BytesIO()
+    for c in range(commits):
+        message = b'Benchmark commit %d' % c
+        stream.write(b'commit refs/heads/master\n')
+        stream.write(b'committer Benchmark <benchmark@localhost> %d +0000\n' 
+                     % (1500000000 + c))
+        stream.write(b'data %d\n%s\n' % (len(message), message))
+        
+        # The first commit adds every file, later ones change a tenth
+        if c == 0:
+            changed = range(files)
+        else:
+            changed = rng.sample(range(files), max(1, files // 10))
+        for f in changed:
+            data = bytes(rng.choice(b'abcdefghij \n') 
+                         for i in range(file_size))
+            stream.write(b'M 100644 inline src/file%04d.c\n' % f)
+            stream.write(b'data %d\n%s\n' % (len(data), data))
+    
+    subprocess.run(['git', 'fast-import', '--quiet'], cwd=path, 
+                   input=stream.getvalue(), check=True)
+
+def make_fixtures(folder, libraries, commits, files, file_size, seed=0):
+    '''
+    Create a project and its libraries as bare repositories in folder
+    
+    Parameters
+    ----------
+    folder : string
+        Where the repositories are made, standing in for GitHub.
+        
+    libraries : int
+        Number of libraries, all listed in the project's Lib.txt.
+        
+    commits, files, file_size : int
+        History of each library: number of commits, files in the tree and 
+        bytes per file.
+    
+    Returns
+    -------
+    out : base_url
+        URL to use in place of base_URL. The project is called BenchProject
+        and the libraries Bench00, Bench01, ...
+    '''
+    
+    rng = random.Random(seed)
+    names = ['Bench%02d' % i for i in range(libraries)]
+    for name in names:
+        make_history(os.path.join(folder, 'firmware_library_' + name + '.git'),
+                     commits, files, file_size, rng)
+    
+    lib_file = ('\n'.join(names) + '\n').encode('ascii')
+    stream = (b'commit refs/heads/master\n'
+              b'committer Benchmark <benchmark@localhost> 1500000000 +0000\n'
+              b'data 7\nProject\n'
+              b'M 100644 inline Lib.txt\ndata %d\n%s\n' 
+              % (len(lib_file), lib_file))
+    project = os.path.join(folder, 'BenchProject')
+    Repo.init(project, bare=True)
+    subprocess.run(['git', 'fast-import', '--quiet'], cwd=project, 
+                   input=stream, check=True)
+    
+    return folder_url(folder)
+
+# file:// URL of a folder, ending in / so names can be added on
+def folder_url(folder):
+    path = os.path.abspath(folder).replace('\\', '/')
+    if not path.startswith('/'):
+        path = '/' + path
+    return 'file://' + path + '/'
+
+# Stands in for git-upload-pack or git-receive-pack, see inject_faults
+fault_script = r'''
+import os, subprocess, sys, time
+state, mode, command = sys.argv[1:4]
+with open(state) as f:
+    left = int(f.read() or 0)
+if left > 0:
+    with open(state, 'w') as f:
+        f.write(str(left - 1))
+    if mode == 'hang':
+        time.sleep(3600)
+    sys.stderr.write('fatal: the remote end hung up unexpectedly\n')
+    sys.exit(128)
+sys.exit(subprocess.call([command] + sys.argv[4:]))
+'''
+
+def inject_faults(repository, failures=2, mode='fail'):
+    '''
+    Make the next fetches and pushes of a checkout of a local (file://) 
+    remote fail, to try remote_policy out without GitHub going down
+    
+    Parameters
+    ----------
+    repository : Repo
+        Checkout whose remote is on the local disk, e.g. from the benchmark.
+        
+    failures : int
+        Number of fetches and pushes to fail, after which they work again.
+        0 takes the faults out.
+        
+    mode : string
+        'fail' ends each one with a dropped connection, 'hang' never 
+        answers, so only the timeout ends it.
+    '''
+    
+    script = os.path.join(repository.git_dir, 'inject_faults.py')
+    state = os.path.join(repository.git_dir, 'inject_faults')
+    with open(script, 'w') as f:
+        f.write(fault_script)
+    with open(state, 'w') as f:
+        f.write(str(failures))
+    
+    with repository.config_writer() as config:
+        for key, command in [('uploadpack', 'git-upload-pack'), 
+                             ('receivepack', 'git-receive-pack')]:
+            if failures:
+                config.set_value('remote "origin"', key, '"%s" "%s" "%s" %s %s'
+                                 % (sys.executable, script, state, mode, 
+                                    command))
+            elif config.has_option('remote "origin"', key):
+                config.remove_option('remote "origin"', key)
+
+# Run git http-backend for one request, the way a web server runs CGI
+def http_backend(folder):
+    def application(environ, start_response):
+        env = dict(os.environ, GIT_PROJECT_ROOT=folder, GIT_HTTP_EXPORT_ALL='1',
+                   REMOTE_USER='benchmark')   # pushes need a user
+        for key in environ:
+            if isinstance(environ[key], str) and (key.startswith('HTTP_') or 
+                    key in ['REQUEST_METHOD', 'PATH_INFO', 'QUERY_STRING', 
+                            'CONTENT_TYPE', 'REMOTE_ADDR']):
+                env[key] = environ[key]
+        
+        # git sends large pushes in chunks, which wsgiref leaves as they are
+        stream = environ['wsgi.input']
+        if environ.get('HTTP_TRANSFER_ENCODING', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int(stream.readline().split(b';')[0], 16)
+                chunks.append(stream.read(size))
+                stream.readline()
+                if not size:
+                    break
+            body = b''.join(chunks)
+        else:
+            body = stream.read(int(environ.get('CONTENT_LENGTH') or 0))
+        env['CONTENT_LENGTH'] = str(len(body))
+        env.pop('HTTP_TRANSFER_ENCODING', None)
+        
+        output = subprocess.run(['git', 'http-backend'], input=body, env=env,
+                                stdout=subprocess.PIPE).stdout
+        head, _, content = output.partition(b'\r\n\r\n')
+        status = '200 OK'
+        headers = []
+        for line in head.decode('latin-1').split('\r\n'):
+            key, _, value = line.partition(':')
+            if key.lower() == 'status':
+                status = value.strip()
+            elif key:
+                headers.append((key, value.strip()))
+        start_response(status, headers)
+        return [content]
+    return application
+
+class QuietServer(socketserver.ThreadingMixIn, 
+                  wsgiref.simple_server.WSGIServer):
+    daemon_threads = True
+
+class QuietHandler(wsgiref.simple_server.WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+@contextlib.contextmanager
+def serve_repositories(folder, protocol='http'):
+    '''
+    Serve the repositories in a folder over the network on this computer, so
+    the transport settings are used as they are with GitHub
+    
+    Parameters
+    ----------
+    folder : string
+        Folder of bare repositories, e.g. from make_fixtures.
+        
+    protocol : string
+        'http' through git http-backend, which goes through http.version
+        and the low speed limit, 'git' through git daemon, or 'ssh' to 
+        localhost, which goes through the ssh_multiplex ControlMaster and
+        needs an SSH server taking this user's key (check with 
+        ssh localhost true). 'file' serves nothing.
+    
+    Returns
+    -------
+    out : base_url
+        URL to use in place of base_URL while the with block runs.
+    
+    Notes
+    -----
+    The stand-ins ask for no login, so credential_cache is not used. With
+    GIT_TRACE_CURL=1 set, git shows which HTTP version each request used.
+    '''
+    
+    folder = os.path.abspath(folder)
+    if protocol == 'file':
+        yield folder_url(folder)
+    elif protocol == 'ssh':
+        yield 'ssh://localhost' + folder_url(folder)[len('file://'):]
+    elif protocol == 'http':
+        server = wsgiref.simple_server.make_server(
+            '127.0.0.1', 0, http_backend(folder), server_class=QuietServer, 
+            handler_class=QuietHandler)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            yield 'http://127.0.0.1:%d/' % server.server_port
+        finally:
+            server.shutdown()
+            server.server_close()
+    elif protocol == 'git':
+        with socket.socket() as probe:
+            probe.bind(('127.0.0.1', 0))
+            port = probe.getsockname()[1]
+        daemon = subprocess.Popen(
+            ['git', 'daemon', '--reuseaddr', '--export-all', 
+             '--enable=receive-pack', '--listen=127.0.0.1', '--port=%d' % port,
+             '--base-path=' + folder, folder], 
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            for attempt in range(100):
+                with contextlib.suppress(OSError):
+                    socket.create_connection(('127.0.0.1', port), 1).close()
+                    break
+                time.sleep(0.05)
+            yield 'git://127.0.0.1:%d/' % port
+        finally:
+            daemon.kill()
+            daemon.wait()
+    else:
+        raise ValueError('protocol must be file, http, git or ssh')
+
+# Time each workspace operation once, with the given number of workers
+def bench_workspace(base_url, prefix, mode, workers, run):
+    results = []
+    
+    def timed(operation, function, *args):
+        started = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            outcome = function(*args)
+        seconds = time.perf_counter() - started
+        
+        failed = 0
+        if isinstance(outcome, dict):
+            failed = len([x for x in outcome.values() 
+                          if isinstance(x, dict) and x.get('error')])
+        results.append({'operation': operation, 'mode': mode, 
+                        'workers': workers, 'run': run, 'seconds': seconds,
+                        'failed': failed})
+        return outcome
+    
+    changes = {'clone_workers': workers, 'fanout_workers': workers,
+               'use_mirror_cache': False, 'show_progress': False,
+               'attach_existing': False, 'restore_from_lock': False,
+               'fast_startup': False, 'fetch_on_reopen': False, 
+               'watch_files': False, 'prefetch_minutes': 0, 
+               'mirror_directory': prefix + 'Mirrors//'}
+    saved = dict((x, globals()[x]) for x in changes)
+    globals().update(changes)
+    try:
+        timed('clone', lambda: Workspace('BenchProject', prefix, 
+                                         base_url).open())
+        
+        globals()['attach_existing'] = True
+        ws = timed('attach', lambda: Workspace('BenchProject', prefix, 
+                                               base_url).open())
+        names = list(ws.index)
+        
+        globals()['fast_startup'] = True
+        timed('reopen', lambda: Workspace('BenchProject', prefix, 
+                                          base_url).open())
+        
+        timed('status', ws.status_table, True)
+        timed('status (cached)', ws.status_table)
+        
+        for name in names:
+            with open(os.path.join(ws.index[name].path, 'bench.txt'), 'a') as f:
+                f.write('%s %d\n' % (mode, run))
+        
+        timed('add', fan_out, ws.add, names)
+        timed('commit', fan_out, lambda x: ws.commit(x, 'Benchmark'), names)
+        timed('push', fan_out, lambda x: ws.push(x).raise_if_error(), names)
+        timed('branch', ws.change_branch, 'bench-%s-%d' % (mode, run))
+    finally:
+        globals().update(saved)
+    return results
+
+def benchmark(libraries=10, commits=20, files=50, file_size=2048, workers=8,
+              repeat=1, folder=None, transport='file'):
+    '''
+    Time clone, attach, status, add, commit, push and branch creation on 
+    made up repositories, serially and in parallel
+    
+    Parameters
+    ----------
+    libraries, commits, files, file_size : int
+        Size of the stand-in repositories, see make_fixtures.
+        
+    workers : int
+        Workers used in the parallel runs.
+        
+    repeat : int
+        Number of times every operation is timed in each mode.
+        
+    folder : string
+        Where the repositories and workspaces are made. A new temporary 
+        folder, removed afterwards, if not given.
+        
+    transport : string
+        How the stand-in repositories are reached: 'file', or 'http', 'git'
+        or 'ssh' to go through the network settings, see 
+        serve_repositories.
+    
+    Returns
+    -------
+    out : results
+        List of dictionaries with operation, mode, workers, run, seconds 
+        and the number of repositories it failed in.
+    '''
+    
+    temporary = folder is None
+    if temporary:
+        folder = tempfile.mkdtemp(prefix='tomscript-bench-')
+    
+    try:
+        make_fixtures(os.path.join(folder, 'remote'), libraries, commits, 
+                      files, file_size)
+        results = []
+        with serve_repositories(os.path.join(folder, 'remote'), 
+                                transport) as base_url:
+            for run in range(repeat):
+                for mode, count in [('serial', 1), ('parallel', workers)]:
+                    prefix = os.path.join(folder, '%s-%d' % (mode, run)) + '/'
+                    results += bench_workspace(base_url, prefix, mode, count, 
+                                               run)
+    finally:
+        if temporary:
+            shutil.rmtree(folder, onerror=remove_readonly)
+    return results
+
+# Median time of each operation, serial against parallel
+def print_benchmark(results):
+    operations = list(dict.fromkeys(x['operation'] for x in results))
+    print('Operation            Serial  Parallel  Speed-up')
+    for operation in operations:
+        times = {}
+        for mode in ['serial', 'parallel']:
+            runs = [x['seconds'] for x in results 
+                    if x['operation'] == operation and x['mode'] == mode]
+            times[mode] = statistics.median(runs) if runs else float('nan')
+        print('%-18s %7.2fs %8.2fs %8.1fx' 
+              % (operation, times['serial'], times['parallel'], 
+                 times['serial'] / times['parallel'] 
+                 if times['parallel'] else float('nan')))
+    failed = sum(x['failed'] for x in results)
+    if failed:
+        print('%d repository operations failed.' % failed)
+    return
+
+def benchmark_main(arguments):
+    parser = argparse.ArgumentParser(
+        prog='TomScript v2.1.py --benchmark',
+        description='Time workspace operations against local repositories.')
+    parser.add_argument('--benchmark', action='store_true')
+    parser.add_argument('--libraries', type=int, default=10)
+    parser.add_argument('--commits', type=int, default=20)
+    parser.add_argument('--files', type=int, default=50)
+    parser.add_argument('--file-size', type=int, default=2048)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--folder', help='keep the repositories here')
+    parser.add_argument('--transport', default='file', 
+                        choices=['file', 'http', 'git', 'ssh'],
+                        help='reach the repositories through this protocol')
+    parser.add_argument('--output', help='write the results here as JSON')
+    options = parser.parse_args(arguments)
+    
+    results = benchmark(options.libraries, options.commits, options.files,
+                        options.file_size, options.workers, options.repeat,
+                        options.folder, options.transport)
+    print_benchmark(results)
+    
+    if options.output:
+        settings = dict(vars(options))
+        del settings['benchmark'], settings['output']
+        with open(options.output, 'w') as saved:
+            json.dump({'settings': settings, 'results': results}, saved, 
+                      indent=1)
+    return results
+
+#==============================================================================
+# Session start
+#==============================================================================
+
+# Run as a script the project is asked for straight away. Imported, nothing
+# happens until start() or the first function that needs the repositories.
+# With --benchmark the benchmark runs instead.
+if __name__ == '__main__':
+    if '--benchmark' in sys.argv[1:]:
+        benchmark_main(sys.argv[1:])
+    else:
+        print('')
+        start()
+        print('-----------------------------------------------')
+        print('Type contents() for a list of functions.')
+        print('Type workflow() for help in functional logic.')
\ No newline at end of file
@@ -0,0 +1,146 @@
+"""
+Tests of the paths that talk to GitHub, against stand-in repositories made
+on the local disk with make_fixtures
+
+Run with
+
+    python -m pytest tests
+
+"""
+
+import importlib.util
+import os
+import subprocess
+import time
+
+import pytest
+
+# The script's name has spaces in it, so it is loaded from its path
+script = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                      'TomScript v2.1.py')
+spec = importlib.util.spec_from_file_location('tomscript', script)
+tomscript = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(tomscript)
+
+#==============================================================================
+# Fixtures
+#==============================================================================
+
+# Settings as the benchmark runs with them, so nothing outside tmp_path is
+# touched and nothing runs in the background
+@pytest.fixture
+def settings(monkeypatch):
+    changes = {'use_mirror_cache': False, 'show_progress': False,
+               'attach_existing': False, 'restore_from_lock': False,
+               'fast_startup': False, 'fetch_on_reopen': False,
+               'watch_files': False, 'prefetch_minutes': 0,
+               'execution_engine': 'threads'}
+    for name in changes:
+        monkeypatch.setattr(tomscript, name, changes[name])
+    monkeypatch.setattr(tomscript, 'breaker', tomscript.CircuitBreaker())
+    monkeypatch.setattr(tomscript, 'remote_policy',
+                        dict(tomscript.remote_policy, backoff=0.01))
+    return tomscript.remote_policy
+
+# A project with two libraries, cloned into tmp_path
+@pytest.fixture
+def workspace(tmp_path, settings):
+    remote = str(tmp_path / 'remote')
+    base_url = tomscript.make_fixtures(remote, 2, 2, 3, 64)
+    ws = tomscript.Workspace('BenchProject', str(tmp_path / 'work') + '/',
+                             base_url)
+    ws.open()
+    ws.remote = remote
+    return ws
+
+# Branch names in a stand-in repository on "GitHub"
+def remote_branches(ws, name):
+    url = ws.index[name].url
+    output = subprocess.run(['git', 'ls-remote', '--heads', url],
+                            stdout=subprocess.PIPE, text=True, check=True)
+    return [x.split('refs/heads/')[-1] for x in output.stdout.splitlines()]
+
+#==============================================================================
+# change_branch rollback
+#==============================================================================
+
+# A push one library's "GitHub" refuses: not a connection problem, so it is
+# not retried
+def refuse_pushes(ws, name):
+    hook = os.path.join(ws.remote, 'firmware_library_' + name + '.git', 
+                        'hooks', 'pre-receive')
+    with open(hook, 'w', newline='\n') as f:
+        f.write('#!/bin/sh\necho refused >&2\nexit 1\n')
+    os.chmod(hook, 0o755)
+
+def test_rejected_push_rolls_back_every_repository(workspace):
+    refuse_pushes(workspace, 'Bench01')
+    
+    table = workspace.change_branch('feature')
+    
+    assert table['Bench01']['error'] is not None
+    for name in ['Bench00', 'BenchProject']:
+        assert table[name]['error'] is None
+        assert table[name]['note'] == 'rolled back'
+    for name in workspace.index:
+        repo = workspace.index[name].repo
+        assert repo.active_branch.name == 'master'
+        assert 'feature' not in repo.heads
+        assert 'feature' not in remote_branches(workspace, name)
+
+def test_branch_made_by_someone_else_is_left_alone(workspace):
+    # A colleague made the branch after this session last fetched
+    subprocess.run(['git', '--git-dir', os.path.join(
+        workspace.remote, 'firmware_library_Bench00.git'), 'branch', 
+        'feature', 'master'], check=True)
+    
+    table = workspace.change_branch('feature')
+    
+    assert 'already on GitHub' in str(table['Bench00']['error'])
+    assert 'feature' in remote_branches(workspace, 'Bench00')
+    assert 'feature' not in remote_branches(workspace, 'Bench01')
+
+#==============================================================================
+# Retries, timeouts and the circuit breaker
+#==============================================================================
+
+# Attempts inject_faults has not failed yet
+def faults_left(ws, name):
+    with open(os.path.join(ws.index[name].repo.git_dir, 
+                           'inject_faults')) as f:
+        return int(f.read())
+
+def test_transient_failures_are_retried(workspace, settings):
+    settings['retries'] = 2
+    tomscript.inject_faults(workspace.repo('Bench00'), 2)
+    
+    workspace.fetch('Bench00')
+    
+    assert faults_left(workspace, 'Bench00') == 0
+
+def test_hang_ends_in_timeout(workspace, settings):
+    settings['retries'] = 0
+    settings['timeouts'] = dict(settings['timeouts'], fetch=2)
+    tomscript.inject_faults(workspace.repo('Bench00'), 1, 'hang')
+    
+    started = time.time()
+    with pytest.raises(TimeoutError):
+        workspace.fetch('Bench00')
+    assert 2 <= time.time() - started < 15
+
+def test_breaker_opens_after_failures(workspace, settings):
+    settings.update(retries=0, breaker_failures=3, breaker_seconds=60)
+    tomscript.inject_faults(workspace.repo('Bench00'), 10)
+    
+    for attempt in range(3):
+        with pytest.raises(tomscript.GitCommandError):
+            workspace.fetch('Bench00')
+    
+    # Given up on: the remote is not even tried
+    with pytest.raises(tomscript.RemoteUnavailable):
+        workspace.fetch('Bench00')
+    assert faults_left(workspace, 'Bench00') == 7
+    
+    # Every repository on the same host is given up on too
+    with pytest.raises(tomscript.RemoteUnavailable):
+        workspace.fetch('Bench01')